@@ -1,70 +1,139 @@
-import threading
+# Load .env before the modules below read their settings from the environment
+from dotenv import load_dotenv
+load_dotenv()
+
 import uuid
+import secrets
 import time
-from flask import Flask, render_template, request, redirect, session, url_for, flash, jsonify
+import json
+import threading
+from flask import Flask, Response, render_template, request, redirect, session, url_for, flash, jsonify, stream_with_context
 import os
 from spotify_helper import (
-    get_auth_url, REDIRECT_URI, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET,
-    get_current_user_id, create_spotify_playlist, add_songs_to_playlist, extract_playlist_id
+    get_auth_url, SPOTIFY_CLIENT_ID, exchange_code, refresh_token,
+    get_current_user_id, create_spotify_playlist, add_songs_to_playlist, extract_playlist_id,
+    resolve_songs, add_resolved_to_playlist, sync_resolved_to_playlist
 )
-from cli import get_setlist_from_url
-import requests
+from setlists import get_setlist_from_url, setlist_id_from_url
+from cache import get_track_cache, get_playlist_index
+from jobs import JobExecutor, SharedWork, make_job_store
+from tokens import shared_token_manager
+from metrics import metrics
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# Set FLASK_SECRET_KEY when running several gunicorn workers so they all accept the same session cookie
+app.secret_key = os.getenv("FLASK_SECRET_KEY") or os.urandom(24)
 
 
-task_status = {}
+task_status = make_job_store()
+# Spotify tokens stay on the server, keyed by an opaque id that is all the session cookie holds.
+# Logins are forgotten after LOGIN_TTL seconds without a request.
+LOGIN_TTL = int(os.getenv("LOGIN_TTL", 30 * 24 * 3600))
+logins = make_job_store(ttl=LOGIN_TTL, table="logins")
+job_executor = JobExecutor()
+# Jobs for a setlist that is already being fetched and searched wait for that work instead of repeating it
+shared_work = SharedWork()
+# Each open /events stream holds a server thread until its job finishes, so only this many are
+# accepted per process; the page falls back to polling /status beyond that
+MAX_EVENT_STREAMS = int(os.getenv("MAX_EVENT_STREAMS", 8))
+event_streams = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
 
-def background_sync(task_id, token, setlist_url, playlist_mode, new_name, existing_url):
-    try:
-        # 1. Get Songs
+def fetch_and_resolve(token_manager, setlist_url, progress_callback):
+    """Returns (songs, artist, resolved) for the setlist, computed once for all concurrent jobs that ask for it."""
+    def work(progress):
         songs, artist = get_setlist_from_url(setlist_url)
         if not songs:
-            task_status[task_id] = {'finished': True, 'success': False, 'message': "No songs found."}
+            return songs, artist, []
+        return songs, artist, resolve_songs(token_manager, songs, artist, get_track_cache(), progress)
+
+    key = setlist_id_from_url(setlist_url) or setlist_url
+    return shared_work.run(key, work, progress_callback)
+
+def background_sync(task_id, token_manager, setlist_url, playlist_mode, new_name, existing_url, sync=False):
+    task_status.update(task_id, {'status': 'Starting...'})
+    try:
+        # The job may have waited in the queue, so check the session only now. Every request
+        # below asks the manager again, so a long job picks up refreshed tokens.
+        if not token_manager.get_access_token():
+            task_status.set(task_id, {'finished': True, 'success': False, 'message': "Spotify session expired, please log in again."})
+            return
+
+        # Define the callback to update global dict
+        def update_progress(current, total, message):
+            task_status.update(task_id, {
+                'current': current,
+                'total': total,
+                'status': message,
+                'percent': int((current / total) * 100) if total > 0 else 0
+            })
+
+        # 1. Get and search songs, shared with other jobs for the same setlist
+        songs, artist, resolved = fetch_and_resolve(token_manager, setlist_url, update_progress)
+        if not songs:
+            task_status.set(task_id, {'finished': True, 'success': False, 'message': "No songs found."})
             return
 
         # 2. Get/Create Playlist
-        user_id = get_current_user_id(token)
+        user_id = get_current_user_id(token_manager)
         playlist_id = None
 
         if playlist_mode == 'new':
             final_name = new_name if new_name else f"{artist} Setlist"
-            playlist_id = create_spotify_playlist(token, user_id, final_name, "Created via Web App")
+            playlist_id = create_spotify_playlist(token_manager, user_id, final_name, "Created via Web App")
         elif playlist_mode == 'existing':
             if existing_url:
                 playlist_id = extract_playlist_id(existing_url)
 
         if not playlist_id:
-            task_status[task_id] = {'finished': True, 'success': False, 'message': "Invalid Playlist ID."}
+            task_status.set(task_id, {'finished': True, 'success': False, 'message': "Invalid Playlist ID."})
             return
 
-        # Define the callback to update global dict
-        def update_progress(current, total, message):
-            task_status[task_id].update({
-                'current': current,
-                'total': total,
-                'status': message,
-                'percent': int((current / total) * 100) if total > 0 else 0
-            })
+        # 3. Add the new songs, or make the playlist match the setlist exactly
+        update_progress(len(songs), len(songs), "Updating playlist...")
+        if sync and playlist_mode == 'existing':
+            result = sync_resolved_to_playlist(token_manager, songs, resolved, playlist_id, get_playlist_index())
+            success = result['ok']
+            if result['failed']:
+                message = (f"Sync stopped: {result['failed']} songs could not be looked up, "
+                           "so the playlist was left unchanged. Please try again later.")
+            elif success:
+                message = f"Done! Synced playlist: {result['added']} added, {result['removed']} removed."
+            else:
+                message = "Sync stopped: Spotify rejected a playlist change."
+        else:
+            added_count = add_resolved_to_playlist(token_manager, songs, resolved, playlist_id, get_playlist_index())
+            success = True
+            message = f"Done! Added {added_count} songs."
 
-        # 3. Add songs with callback
-        added_count = add_songs_to_playlist(token, songs, artist, playlist_id, progress_callback=update_progress)
-        
         # Mark complete
-        task_status[task_id].update({
+        task_status.update(task_id, {
             'finished': True, 
-            'success': True, 
-            'message': f"Done! Added {added_count} songs.",
+            'success': success,
+            'message': message,
             'percent': 100
         })
 
     except Exception as e:
-        task_status[task_id] = {'finished': True, 'success': False, 'message': f"Error: {str(e)}"}
+        task_status.set(task_id, {'finished': True, 'success': False, 'message': f"Error: {str(e)}"})
+
+def session_tokens():
+    """Returns the logged-in user's token record from the server-side login store, or None."""
+    sid = session.get('sid')
+    return logins.get(sid) if sid else None
+
+def session_access_token():
+    """Returns a valid access token for the logged-in user, refreshing it when it is about to expire."""
+    tokens = session_tokens()
+    if not tokens:
+        return None
+    manager = shared_token_manager(tokens, refresh_token)
+    token = manager.get_access_token()
+    logins.set(session['sid'], manager.tokens)
+    return token
 
 @app.route('/')
 def index():
-    return render_template('index.html', logged_in='token' in session)
+    return render_template('index.html', logged_in=session_tokens() is not None)
 
 @app.route('/login')
 def login():
@@ -73,19 +142,17 @@ def login():
 @app.route('/callback')
 def callback():
     code = request.args.get('code')
-    res = requests.post("https://accounts.spotify.com/api/token", data={
-        "grant_type": "authorization_code",
-        "code": code,
-        "redirect_uri": REDIRECT_URI,
-        "client_id": SPOTIFY_CLIENT_ID,
-        "client_secret": SPOTIFY_CLIENT_SECRET
-    })
-    session['token'] = res.json().get('access_token')
+    tokens, res = exchange_code(code)
+    if not tokens:
+        flash(f"Spotify login failed: {res.status_code}")
+        return redirect(url_for('index'))
+    session['sid'] = secrets.token_urlsafe(32)
+    logins.set(session['sid'], tokens)
     return redirect(url_for('index'))
 
 @app.route('/sync', methods=['POST'])
 def sync():
-    token = session.get('token')
+    token = session_access_token()
     if not token:
         return redirect(url_for('login'))
 
@@ -120,9 +187,13 @@ def sync():
                 return redirect(url_for('index'))
 
         # 3. Add songs
-        added_count = add_songs_to_playlist(token, songs, artist, playlist_id)
-        
-        flash(f"Successfully added {added_count} songs to your playlist!")
+        added_count, failed = add_songs_to_playlist(token, songs, artist, playlist_id,
+                                                    track_cache=get_track_cache(), playlist_index=get_playlist_index())
+
+        if failed:
+            flash(f"Added {added_count} songs; {failed} could not be added, please try again.")
+        else:
+            flash(f"Successfully added {added_count} songs to your playlist!")
     except Exception as e:
         flash(f"Error: {str(e)}")
 
@@ -130,35 +201,75 @@ def sync():
 
 @app.route('/start_sync_job', methods=['POST'])
 def start_sync_job():
-    token = session.get('token')
+    token = session_access_token()
     if not token:
         return jsonify({'error': 'Not logged in'}), 401
+    token_manager = shared_token_manager(session_tokens(), refresh_token)
 
     # Generate a unique ID for this job
     task_id = str(uuid.uuid4())
     
     # Initialize status
-    task_status[task_id] = {
-        'current': 0, 'total': 1, 'status': 'Starting...', 'percent': 0, 'finished': False
-    }
+    task_status.set(task_id, {
+        'current': 0, 'total': 1, 'status': 'Queued...', 'percent': 0, 'finished': False
+    })
 
     # Extract form data
     data = request.json
-    thread = threading.Thread(target=background_sync, args=(
-        task_id, 
-        token, 
-        data.get('setlist_url'), 
-        data.get('playlist_mode'), 
-        data.get('new_playlist_name'), 
-        data.get('existing_playlist_url')
-    ))
-    thread.start()
+    accepted = job_executor.submit(
+        background_sync,
+        task_id,
+        token_manager,
+        data.get('setlist_url'),
+        data.get('playlist_mode'),
+        data.get('new_playlist_name'),
+        data.get('existing_playlist_url'),
+        bool(data.get('sync'))
+    )
+    if not accepted:
+        task_status.delete(task_id)
+        response = jsonify({'error': 'Server is busy, please try again in a minute.'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
 
     return jsonify({'task_id': task_id})
 
 @app.route('/status/<task_id>')
 def status(task_id):
-    return jsonify(task_status.get(task_id, {'error': 'Unknown task'}))
+    return jsonify(task_status.get(task_id) or {'error': 'Unknown task'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/events/<task_id>')
+def events(task_id):
+    """Server-Sent Events stream of a job's progress; /status stays as the polling fallback."""
+    if not event_streams.acquire(blocking=False):
+        response = jsonify({'error': 'Too many progress streams, poll /status instead.'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def generate():
+        last_state = None
+        while True:
+            state = task_status.wait_for_change(task_id, last_state, timeout=15)
+            if state is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Unknown task'})}\n\n"
+                return
+            if state == last_state:
+                yield ": keep-alive\n\n"
+                continue
+            last_state = state
+            yield f"data: {json.dumps(state)}\n\n"
+            if state.get('finished'):
+                return
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the stream ends or the client goes away, also if it never started
+    response.call_on_close(event_streams.release)
+    return response
 
 if __name__ == '__main__':
     print(f"DEBUG: Client ID is {SPOTIFY_CLIENT_ID}")
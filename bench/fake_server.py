@@ -0,0 +1,299 @@
+"""Local stand-in for the Spotify Web API and setlist.fm, used by bench/run.py.
+
+Only the endpoints this project calls are implemented. Responses are
+deterministic, so runs can be compared from one version to the next.
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ARTIST_NAME = "Bench Band"
+ARTIST_ID = "benchartist"
+ALBUM_SIZE = 12
+
+
+class FakeState:
+    """Configuration, playlists and request statistics shared by both fake servers."""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1, song_pool=200,
+                 setlist_songs=25, setlist_count=40, miss_every=15, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.songs = [f"Song {i}" for i in range(song_pool)]
+        self.by_title = {song.lower(): song for song in self.songs}
+        self.setlist_songs = setlist_songs
+        self.setlist_count = setlist_count
+        # Every n-th setlist entry is a song Spotify does not have
+        self.miss_every = miss_every
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.playlists = {}  # playlist_id -> {"uris": [...], "snapshot": int}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = {}
+            self.latencies = []
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.latencies.append(seconds)
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def should_throttle(self):
+        with self.lock:
+            return self.rate_429 > 0 and self.random.random() < self.rate_429
+
+    def delay(self):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    def make_playlist(self, playlist_id, size):
+        """Creates (or replaces) a playlist holding `size` filler tracks."""
+        with self.lock:
+            self.playlists[playlist_id] = {
+                "uris": [f"spotify:track:filler{i}" for i in range(size)],
+                "snapshot": 1,
+            }
+
+    def setlist_ids(self):
+        return [f"{i:08x}" for i in range(1, self.setlist_count + 1)]
+
+    def setlist(self, setlist_id):
+        """A setlist drawn from a window of the song pool, so setlists of one tour overlap heavily."""
+        seed = zlib.crc32(setlist_id.encode())
+        start = seed % max(1, len(self.songs) // 10)
+        songs = []
+        for i in range(self.setlist_songs):
+            if self.miss_every and i % self.miss_every == self.miss_every - 1:
+                songs.append({"name": f"Unreleased Jam {seed % 97}-{i}"})
+            else:
+                songs.append({"name": self.songs[(start + i) % len(self.songs)]})
+        return {
+            "id": setlist_id,
+            "eventDate": "01-06-2024",
+            "artist": {"name": ARTIST_NAME},
+            "venue": {"name": "Bench Arena", "city": {"name": "Lisbon", "country": {"name": "Portugal"}}},
+            "url": setlist_url(setlist_id),
+            "sets": {"set": [{"song": songs}]},
+        }
+
+
+def setlist_url(setlist_id):
+    return f"https://www.setlist.fm/setlist/bench-band/2024/bench-arena-lisbon-portugal-{setlist_id}.html"
+
+
+def track_object(song, suffix=""):
+    name = song + suffix
+    return {
+        "uri": "spotify:track:" + re.sub(r"\W", "", name.lower()),
+        "name": name,
+        "artists": [{"name": ARTIST_NAME, "id": ARTIST_ID}],
+    }
+
+
+def paging(items, offset, limit, total, next_url):
+    return {
+        "items": items,
+        "offset": offset,
+        "limit": limit,
+        "total": total,
+        "next": next_url if offset + limit < total else None,
+    }
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    state = None  # set by make_server
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw or b"{}")
+        return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+    def _handle(self, method):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body() if method in ("POST", "PUT", "DELETE") else None
+        endpoint = re.sub(r"/(playlists|users|artists|albums|setlist)/[^/]+", r"/\1/{id}", url.path)
+
+        self.state.delay()
+        if self.state.should_throttle():
+            self._send(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                       {"Retry-After": str(self.state.retry_after)})
+        else:
+            status, payload = self.route(method, url.path, query, body)
+            self._send(status, payload)
+        self.state.record(f"{method} {endpoint}", time.perf_counter() - started)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def base(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def route(self, method, path, query, body):
+        state = self.state
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+
+        if path == "/api/token" and method == "POST":
+            return 200, {"access_token": "bench-token", "token_type": "Bearer", "expires_in": 3600}
+
+        if path == "/v1/me":
+            return 200, {"id": "benchuser"}
+
+        if path == "/v1/me/playlists":
+            with state.lock:
+                ids = sorted(state.playlists)
+            items = [{"id": pid, "name": pid} for pid in ids[offset:offset + limit]]
+            return 200, paging(items, offset, limit, len(ids), f"{self.base()}{path}?offset={offset + limit}&limit={limit}")
+
+        match = re.fullmatch(r"/v1/users/([^/]+)/playlists", path)
+        if match and method == "POST":
+            playlist_id = f"benchpl{random.randrange(16 ** 8):08x}"
+            state.make_playlist(playlist_id, 0)
+            return 201, {"id": playlist_id, "name": body.get("name", "")}
+
+        match = re.fullmatch(r"/v1/playlists/([^/]+)/tracks", path)
+        if match:
+            playlist_id = match.group(1)
+            with state.lock:
+                playlist = state.playlists.setdefault(playlist_id, {"uris": [], "snapshot": 1})
+                if method == "POST":
+                    uris = body.get("uris", [])
+                    if len(uris) > 100:
+                        return 400, {"error": {"status": 400, "message": "Too many ids requested"}}
+                    playlist["uris"].extend(uris)
+                    playlist["snapshot"] += 1
+                    return 201, {"snapshot_id": f"snap{playlist['snapshot']}"}
+                if method == "DELETE":
+                    removed = {track["uri"] for track in body.get("tracks", [])}
+                    if len(removed) > 100:
+                        return 400, {"error": {"status": 400, "message": "Too many ids requested"}}
+                    playlist["uris"] = [uri for uri in playlist["uris"] if uri not in removed]
+                    playlist["snapshot"] += 1
+                    return 200, {"snapshot_id": f"snap{playlist['snapshot']}"}
+                if method == "PUT":
+                    # Positions are applied to the current contents; snapshot_id is not checked
+                    if "uris" in body:
+                        playlist["uris"] = list(body["uris"][:100])
+                    else:
+                        uris = playlist["uris"]
+                        start, before = body["range_start"], body["insert_before"]
+                        moved = uris[start:start + body.get("range_length", 1)]
+                        rest = uris[:start] + uris[start + len(moved):]
+                        at = before - len(moved) if before > start else before
+                        playlist["uris"] = rest[:at] + moved + rest[at:]
+                    playlist["snapshot"] += 1
+                    return 200, {"snapshot_id": f"snap{playlist['snapshot']}"}
+                limit = min(limit if "limit" in query else 100, 100)
+                uris = playlist["uris"][offset:offset + limit]
+                total = len(playlist["uris"])
+            items = [{"track": {"uri": uri, "name": uri.rsplit(":", 1)[-1]}} for uri in uris]
+            return 200, paging(items, offset, limit, total, f"{self.base()}{path}?offset={offset + limit}&limit={limit}")
+
+        match = re.fullmatch(r"/v1/playlists/([^/]+)", path)
+        if match:
+            with state.lock:
+                playlist = state.playlists.setdefault(match.group(1), {"uris": [], "snapshot": 1})
+                return 200, {"id": match.group(1), "snapshot_id": f"snap{playlist['snapshot']}",
+                             "tracks": {"total": len(playlist["uris"])}}
+
+        if path == "/v1/search":
+            return 200, self.search(query)
+
+        match = re.fullmatch(r"/v1/artists/([^/]+)/albums", path)
+        if match:
+            album_count = (len(state.songs) + ALBUM_SIZE - 1) // ALBUM_SIZE
+            items = [{"id": f"benchalb{i:04d}", "name": f"Album {i}"}
+                     for i in range(offset, min(offset + limit, album_count))]
+            return 200, paging(items, offset, limit, album_count, f"{self.base()}{path}?offset={offset + limit}&limit={limit}")
+
+        if path == "/v1/albums":
+            albums = []
+            for album_id in query.get("ids", "").split(","):
+                index = int(album_id[-4:])
+                songs = state.songs[index * ALBUM_SIZE:(index + 1) * ALBUM_SIZE]
+                albums.append({"id": album_id, "tracks": paging([track_object(s) for s in songs], 0, 50, len(songs), None)})
+            return 200, {"albums": albums}
+
+        match = re.fullmatch(r"/rest/1.0/setlist/([0-9a-f]+)", path)
+        if match:
+            return 200, state.setlist(match.group(1))
+
+        if path == "/rest/1.0/search/setlists":
+            page = int(query.get("p", 1))
+            ids = state.setlist_ids()
+            chunk = ids[(page - 1) * 20:page * 20]
+            if not chunk:
+                return 404, {"code": 404, "message": "not found"}
+            return 200, {"setlist": [state.setlist(i) for i in chunk], "total": len(ids), "page": page,
+                         "itemsPerPage": 20}
+
+        return 404, {"error": {"status": 404, "message": f"No fake for {method} {path}"}}
+
+    def search(self, query):
+        q = query.get("q", "")
+        limit = int(query.get("limit", 20))
+        if query.get("type") == "artist":
+            return {"artists": {"items": [{"name": ARTIST_NAME, "id": ARTIST_ID}]}}
+
+        title = re.search(r'track:"([^"]+)"', q)
+        if title:
+            title = title.group(1)
+        else:
+            title = re.sub(r'artist:"[^"]*"', "", q).replace(ARTIST_NAME, "").strip()
+        song = self.state.by_title.get(title.lower())
+        if not song:
+            return {"tracks": {"items": [], "total": 0}}
+        # A live version first, like Spotify often does, to exercise the matcher
+        candidates = [track_object(song, " - Live"), track_object(song)]
+        return {"tracks": {"items": candidates[:limit], "total": len(candidates)}}
+
+
+def make_server(state, port=0):
+    handler = type("BoundFakeHandler", (FakeHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,223 @@
+"""Benchmarks the sync paths against a local fake Spotify and setlist.fm.
+
+    python bench/run.py --latency 0.05 --playlist-size 5000 --repeat 5
+    python bench/run.py --scenarios add_songs,file_batch --rate-429 0.02 --json results.json
+
+Reports requests per song, wall time and p50/p95 latency for each scenario.
+Settings such as SEARCH_CONCURRENCY or SPOTIFY_RATE_LIMIT are read from the
+environment as usual, so the same knobs can be compared between runs.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_server import ARTIST_NAME, FakeState, make_server, setlist_url  # noqa: E402
+
+SCENARIOS = ("playlist_tracks", "add_songs", "file", "file_batch", "artist", "web")
+PLAYLIST_ID = "benchplaylist0001"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark setlist_to_spotify against a local fake API.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated list of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every fake response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--playlist-size", type=int, default=2000, help="Tracks already in the destination playlist")
+    parser.add_argument("--songs", type=int, default=30, help="Songs per setlist")
+    parser.add_argument("--setlists", type=int, default=10, help="Setlists in the file and artist scenarios")
+    parser.add_argument("--web-jobs", type=int, default=8, help="Concurrent /start_sync_job requests")
+    parser.add_argument("--warm", action="store_true", help="Keep caches between repeats instead of starting cold")
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args()
+
+
+def configure(args):
+    """Starts the fake servers and points the client at them. Must run before the app modules are imported."""
+    state = FakeState(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                      retry_after=args.retry_after, setlist_songs=args.songs, setlist_count=max(args.setlists, 1))
+    # Spotify and setlist.fm get separate ports so each keeps its own rate-limit bucket
+    _, spotify_base = make_server(state)
+    _, setlist_base = make_server(state)
+    os.environ["SPOTIFY_API_BASE"] = spotify_base
+    os.environ["SPOTIFY_ACCOUNTS_BASE"] = spotify_base
+    os.environ["SETLIST_FM_API_BASE"] = f"{setlist_base}/rest/1.0"
+    os.environ["SETLIST_CACHE_DB"] = os.path.join(tempfile.mkdtemp(prefix="setlist-bench-"), "cache.db")
+    os.environ.setdefault("SETLIST_FM_API_KEY", "bench")
+    return state
+
+
+def reset_caches(workdir):
+    import cache
+    import catalog
+
+    path = os.path.join(workdir, f"cache-{time.monotonic_ns()}.db")
+    cache._track_cache = cache.TrackCache(path)
+    cache._playlist_index = cache.PlaylistIndex(path)
+    cache._setlist_cache = cache.SetlistCache(path)
+    catalog._catalogs.clear()
+
+
+def run_playlist_tracks(state, args):
+    import spotify_helper
+
+    state.make_playlist(PLAYLIST_ID, args.playlist_size)
+    spotify_helper.get_playlist_tracks("bench-token", PLAYLIST_ID, spotify_helper.PLAYLIST_TRACK_FIELDS)
+    return 0
+
+
+def run_add_songs(state, args):
+    import cache
+    import spotify_helper
+
+    state.make_playlist(PLAYLIST_ID, args.playlist_size)
+    setlist = state.setlist(state.setlist_ids()[0])
+    songs = [song["name"] for song in setlist["sets"]["set"][0]["song"]]
+    spotify_helper.add_songs_to_playlist("bench-token", songs, setlist["artist"]["name"], PLAYLIST_ID,
+                                         track_cache=cache.get_track_cache(),
+                                         playlist_index=cache.get_playlist_index())
+    return len(songs)
+
+
+def _write_url_file(state, args, workdir):
+    path = os.path.join(workdir, "setlists.txt")
+    with open(path, "w") as f:
+        for setlist_id in state.setlist_ids()[:args.setlists]:
+            f.write(setlist_url(setlist_id) + "\n")
+    return path
+
+
+def run_file(state, args, workdir, batched=False):
+    import cli
+
+    state.make_playlist(PLAYLIST_ID, args.playlist_size)
+    path = _write_url_file(state, args, workdir)
+    if batched:
+        cli.process_setlists_batched(cli.iter_setlists_from_file(path), "bench-token", PLAYLIST_ID)
+    else:
+        cli.process_setlists_from_file(path, "bench-token", PLAYLIST_ID)
+    return args.setlists * args.songs
+
+
+def run_artist(state, args):
+    import cli
+
+    state.make_playlist(PLAYLIST_ID, args.playlist_size)
+    cli.process_setlists(cli.iter_setlists_from_search(ARTIST_NAME), "bench-token", PLAYLIST_ID)
+    return state.setlist_count * args.songs
+
+
+def run_web(state, args):
+    import app
+
+    state.make_playlist(PLAYLIST_ID, args.playlist_size)
+    client = app.app.test_client()
+    app.logins.set("bench-session", {"access_token": "bench-token", "refresh_token": "bench-refresh",
+                                     "expires_at": time.time() + 3600})
+    with client.session_transaction() as session:
+        session["sid"] = "bench-session"
+
+    task_ids = []
+    for setlist_id in state.setlist_ids()[:args.web_jobs]:
+        res = client.post("/start_sync_job", json={
+            "setlist_url": setlist_url(setlist_id),
+            "playlist_mode": "existing",
+            "existing_playlist_url": PLAYLIST_ID,
+        })
+        if res.status_code == 200:
+            task_ids.append(res.get_json()["task_id"])
+
+    pending = set(task_ids)
+    while pending:
+        pending = {t for t in pending if not (app.task_status.get(t) or {}).get("finished")}
+        time.sleep(0.02)
+    return len(task_ids) * args.songs
+
+
+def run_scenario(name, state, args, workdir):
+    runner = {
+        "playlist_tracks": lambda: run_playlist_tracks(state, args),
+        "add_songs": lambda: run_add_songs(state, args),
+        "file": lambda: run_file(state, args, workdir),
+        "file_batch": lambda: run_file(state, args, workdir, batched=True),
+        "artist": lambda: run_artist(state, args),
+        "web": lambda: run_web(state, args),
+    }[name]
+
+    walls, requests_per_run, songs_per_run, latencies = [], [], [], []
+    for i in range(args.repeat):
+        if i == 0 or not args.warm:
+            reset_caches(workdir)
+        state.reset_stats()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            songs = runner()
+        walls.append(time.perf_counter() - started)
+        requests_per_run.append(state.total_requests())
+        songs_per_run.append(songs)
+        latencies.extend(state.latencies)
+
+    total_songs = sum(songs_per_run)
+    return {
+        "scenario": name,
+        "runs": args.repeat,
+        "requests_per_run": statistics.mean(requests_per_run),
+        "requests_per_song": sum(requests_per_run) / total_songs if total_songs else None,
+        "wall_mean_s": statistics.mean(walls),
+        "wall_p50_s": percentile(walls, 50),
+        "wall_p95_s": percentile(walls, 95),
+        "request_p50_ms": percentile(latencies, 50) * 1000,
+        "request_p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def print_results(results):
+    header = f"{'scenario':<16}{'req/run':>9}{'req/song':>10}{'wall p50':>10}{'wall p95':>10}{'http p50':>10}{'http p95':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        per_song = f"{r['requests_per_song']:.2f}" if r["requests_per_song"] is not None else "-"
+        print(f"{r['scenario']:<16}{r['requests_per_run']:>9.1f}{per_song:>10}"
+              f"{r['wall_p50_s']:>9.3f}s{r['wall_p95_s']:>9.3f}s"
+              f"{r['request_p50_ms']:>8.1f}ms{r['request_p95_ms']:>8.1f}ms")
+
+
+def main():
+    args = parse_args()
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    state = configure(args)
+    workdir = tempfile.mkdtemp(prefix="setlist-bench-")
+    results = [run_scenario(name, state, args, workdir) for name in scenarios]
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
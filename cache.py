@@ -0,0 +1,372 @@
+import atexit
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+CACHE_DB = os.getenv("SETLIST_CACHE_DB", ".setlist_cache.db")
+# Songs we could not find are retried after this many seconds (default: 7 days)
+NEGATIVE_TTL = int(os.getenv("TRACK_CACHE_NEGATIVE_TTL", 7 * 24 * 3600))
+# Setlists of shows older than SETLIST_SETTLED_DAYS rarely change and are kept
+# for SETLIST_TTL_OLD seconds; recent shows are revalidated after SETLIST_TTL_RECENT.
+SETLIST_SETTLED_DAYS = int(os.getenv("SETLIST_SETTLED_DAYS", 14))
+SETLIST_TTL_RECENT = int(os.getenv("SETLIST_TTL_RECENT", 3600))
+SETLIST_TTL_OLD = int(os.getenv("SETLIST_TTL_OLD", 30 * 24 * 3600))
+# Track cache hits/misses are counted in memory and written out every this many lookups
+STATS_FLUSH_EVERY = int(os.getenv("TRACK_CACHE_STATS_FLUSH_EVERY", 100))
+
+
+def normalize_key(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class TrackCache:
+    """Maps normalized (artist, title) pairs to resolved Spotify track URIs and their match score.
+
+    A cached URI of None is a negative result (song not found), which
+    expires after `negative_ttl` seconds.
+    """
+
+    def __init__(self, path=CACHE_DB, negative_ttl=NEGATIVE_TTL):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._pending = {"hits": 0, "misses": 0}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Lookups read while the index and journal write to the same file
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                " artist TEXT NOT NULL, title TEXT NOT NULL, uri TEXT, label TEXT,"
+                " resolved_at REAL NOT NULL, score REAL, PRIMARY KEY (artist, title))"
+            )
+            # Caches created before scores were kept
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tracks)")}
+            if "score" not in columns:
+                self._conn.execute("ALTER TABLE tracks ADD COLUMN score REAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+        atexit.register(self.flush)
+
+    def _bump(self, name):
+        self._pending[name] += 1
+        if sum(self._pending.values()) >= STATS_FLUSH_EVERY:
+            self._flush()
+
+    def _flush(self):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO cache_stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                [(name, count) for name, count in self._pending.items() if count]
+            )
+        self._pending = {"hits": 0, "misses": 0}
+
+    def flush(self):
+        """Writes the hit/miss counts gathered since the last flush."""
+        with self._lock:
+            self._flush()
+
+    def get(self, artist, title):
+        """Returns (hit, uri, label). A hit with uri None is a cached miss."""
+        key = (normalize_key(artist), normalize_key(title))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT uri, label, resolved_at FROM tracks WHERE artist = ? AND title = ?", key
+            ).fetchone()
+            if row is not None:
+                uri, label, resolved_at = row
+                if uri is not None or time.time() - resolved_at < self.negative_ttl:
+                    self._bump("hits")
+                    return True, uri, label
+            self._bump("misses")
+            return False, None, None
+
+    def peek(self, artist, title):
+        """Returns the cached (uri, label, score), or None, without counting a hit or miss."""
+        key = (normalize_key(artist), normalize_key(title))
+        with self._lock:
+            return self._conn.execute(
+                "SELECT uri, label, score FROM tracks WHERE artist = ? AND title = ?", key
+            ).fetchone()
+
+    def put(self, artist, title, uri, label=None, score=None):
+        key = (normalize_key(artist), normalize_key(title))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tracks (artist, title, uri, label, resolved_at, score)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, uri, label, time.time(), score)
+            )
+
+    def stats(self):
+        with self._lock:
+            rows = dict(self._conn.execute("SELECT name, value FROM cache_stats").fetchall())
+            pending = dict(self._pending)
+        return {name: rows.get(name, 0) + pending[name] for name in ("hits", "misses")}
+
+
+class PlaylistIndex:
+    """Local copy of the track URIs in each playlist, valid for one snapshot_id.
+
+    The index is only refetched when Spotify reports a different snapshot,
+    and is updated in place with the URIs we add ourselves.
+    """
+
+    def __init__(self, path=CACHE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._memory = {}  # playlist_id -> (snapshot_id, set of uris)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS playlists (playlist_id TEXT PRIMARY KEY, snapshot_id TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS playlist_tracks ("
+                " playlist_id TEXT NOT NULL, uri TEXT NOT NULL, PRIMARY KEY (playlist_id, uri))"
+            )
+
+    def get(self, playlist_id, snapshot_id):
+        """Returns the cached set of URIs for this snapshot, or None if it is stale or missing."""
+        with self._lock:
+            cached = self._memory.get(playlist_id)
+            if cached is not None and cached[0] == snapshot_id:
+                return set(cached[1])
+
+            row = self._conn.execute(
+                "SELECT snapshot_id FROM playlists WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+            if row is None or row[0] != snapshot_id:
+                return None
+            uris = {uri for (uri,) in self._conn.execute(
+                "SELECT uri FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,)
+            )}
+            self._memory[playlist_id] = (snapshot_id, uris)
+            return set(uris)
+
+    def replace(self, playlist_id, snapshot_id, uris):
+        uris = set(uris)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO playlist_tracks (playlist_id, uri) VALUES (?, ?)",
+                [(playlist_id, uri) for uri in uris]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO playlists (playlist_id, snapshot_id) VALUES (?, ?)",
+                (playlist_id, snapshot_id)
+            )
+            self._memory[playlist_id] = (snapshot_id, uris)
+
+    def add(self, playlist_id, snapshot_id, uris):
+        """Records URIs we just added, moving the index to the snapshot returned by Spotify."""
+        with self._lock, self._conn:
+            if playlist_id not in self._memory:
+                return
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO playlist_tracks (playlist_id, uri) VALUES (?, ?)",
+                [(playlist_id, uri) for uri in uris]
+            )
+            self._conn.execute(
+                "UPDATE playlists SET snapshot_id = ? WHERE playlist_id = ?", (snapshot_id, playlist_id)
+            )
+            self._memory[playlist_id][1].update(uris)
+            self._memory[playlist_id] = (snapshot_id, self._memory[playlist_id][1])
+
+
+def setlist_ttl(event_date, now=None):
+    """Seconds a setlist stays fresh, based on how long ago the show was (eventDate is dd-MM-yyyy)."""
+    try:
+        day, month, year = (int(part) for part in event_date.split("-"))
+        age = (now or time.time()) - time.mktime((year, month, day, 0, 0, 0, 0, 0, -1))
+    except (AttributeError, ValueError, OverflowError):
+        return SETLIST_TTL_RECENT
+    return SETLIST_TTL_OLD if age > SETLIST_SETTLED_DAYS * 24 * 3600 else SETLIST_TTL_RECENT
+
+
+class SetlistCache:
+    """setlist.fm responses keyed by setlist ID; callers parse songs from the stored body.
+
+    Entries past their TTL are revalidated with If-None-Match/If-Modified-Since
+    when the server gave us an ETag or Last-Modified header.
+    """
+
+    def __init__(self, path=CACHE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            # Caches created while the parsed songs and artist were stored: keep the responses, drop the rest
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(setlists)")}
+            if "songs" in columns:
+                self._conn.execute("ALTER TABLE setlists RENAME TO setlists_old")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS setlists ("
+                " setlist_id TEXT PRIMARY KEY, body TEXT NOT NULL,"
+                " etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            if "songs" in columns:
+                self._conn.execute(
+                    "INSERT INTO setlists SELECT setlist_id, body, etag, last_modified, fetched_at, expires_at"
+                    " FROM setlists_old"
+                )
+                self._conn.execute("DROP TABLE setlists_old")
+
+    def get(self, setlist_id):
+        """Returns the cached entry as a dict (with a `fresh` flag), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, expires_at FROM setlists WHERE setlist_id = ?",
+                (setlist_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, expires_at = row
+        return {
+            "body": json.loads(body),
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh": time.time() < expires_at,
+        }
+
+    def put(self, setlist_id, body, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO setlists"
+                " (setlist_id, body, etag, last_modified, fetched_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (setlist_id, json.dumps(body), etag, last_modified,
+                 now, now + setlist_ttl(body.get("eventDate"), now))
+            )
+
+    def touch(self, setlist_id):
+        """Marks an entry fresh again after a 304 Not Modified."""
+        entry = self.get(setlist_id)
+        if entry is None:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE setlists SET fetched_at = ?, expires_at = ? WHERE setlist_id = ?",
+                (now, now + setlist_ttl(entry["body"].get("eventDate"), now), setlist_id)
+            )
+
+
+class SyncJournal:
+    """Progress of file and artist runs per destination playlist, so --resume can skip finished setlists.
+
+    A setlist is marked completed once all of its songs have been written;
+    every URI written along the way is recorded as soon as Spotify accepts it.
+    """
+
+    def __init__(self, path=CACHE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal_setlists ("
+                " playlist_id TEXT NOT NULL, setlist_id TEXT NOT NULL, completed_at REAL NOT NULL,"
+                " PRIMARY KEY (playlist_id, setlist_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal_uris ("
+                " playlist_id TEXT NOT NULL, uri TEXT NOT NULL, added_at REAL NOT NULL,"
+                " PRIMARY KEY (playlist_id, uri))"
+            )
+
+    def is_completed(self, playlist_id, setlist_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM journal_setlists WHERE playlist_id = ? AND setlist_id = ?",
+                (playlist_id, setlist_id)
+            ).fetchone() is not None
+
+    def complete(self, playlist_id, setlist_ids):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO journal_setlists (playlist_id, setlist_id, completed_at) VALUES (?, ?, ?)",
+                [(playlist_id, setlist_id, now) for setlist_id in setlist_ids]
+            )
+
+    def record_uris(self, playlist_id, uris):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO journal_uris (playlist_id, uri, added_at) VALUES (?, ?, ?)",
+                [(playlist_id, uri, now) for uri in uris]
+            )
+
+    def stats(self, playlist_id):
+        """Returns (completed setlists, added URIs) recorded for the playlist."""
+        with self._lock:
+            setlists = self._conn.execute(
+                "SELECT COUNT(*) FROM journal_setlists WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()[0]
+            uris = self._conn.execute(
+                "SELECT COUNT(*) FROM journal_uris WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()[0]
+        return setlists, uris
+
+    def clear(self, playlist_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM journal_setlists WHERE playlist_id = ?", (playlist_id,))
+            self._conn.execute("DELETE FROM journal_uris WHERE playlist_id = ?", (playlist_id,))
+
+
+_track_cache = None
+_track_cache_lock = threading.Lock()
+
+
+def get_track_cache():
+    global _track_cache
+    with _track_cache_lock:
+        if _track_cache is None:
+            _track_cache = TrackCache()
+        return _track_cache
+
+
+_playlist_index = None
+_playlist_index_lock = threading.Lock()
+
+
+def get_playlist_index():
+    global _playlist_index
+    with _playlist_index_lock:
+        if _playlist_index is None:
+            _playlist_index = PlaylistIndex()
+        return _playlist_index
+
+
+_setlist_cache = None
+_setlist_cache_lock = threading.Lock()
+
+
+def get_setlist_cache():
+    global _setlist_cache
+    with _setlist_cache_lock:
+        if _setlist_cache is None:
+            _setlist_cache = SetlistCache()
+        return _setlist_cache
+
+
+_sync_journal = None
+_sync_journal_lock = threading.Lock()
+
+
+def get_sync_journal():
+    global _sync_journal
+    with _sync_journal_lock:
+        if _sync_journal is None:
+            _sync_journal = SyncJournal()
+        return _sync_journal
@@ -0,0 +1,98 @@
+import threading
+
+import http_client
+from http_client import SPOTIFY_API_BASE
+from matching import ARTIST_THRESHOLD, best_match, normalize, similarity
+from spotify_helper import paginate
+from tokens import auth_header
+
+# /v1/albums accepts at most 20 IDs per request
+ALBUM_BATCH_SIZE = 20
+CATALOG_GROUPS = "album,single"
+
+
+class ArtistCatalog:
+    """Every track on an artist's albums and singles, indexed by normalized title."""
+
+    def __init__(self, artist_id, artist_name, tracks):
+        self.artist_id = artist_id
+        self.artist_name = artist_name
+        self.tracks = tracks
+        self._by_title = {}
+        # Albums are listed before singles, so on equal scores the album version wins
+        for track in tracks:
+            self._by_title.setdefault(normalize(track["name"]), []).append(track)
+
+    def match(self, song):
+        """Returns (track, score) for the song, or (None, 0.0) if the catalog has no acceptable match."""
+        exact = self._by_title.get(normalize(song))
+        if exact:
+            return best_match(exact, song, self.artist_name)
+        return best_match(self.tracks, song, self.artist_name)
+
+
+def find_artist_id(access_token, artist_name):
+    res = http_client.get(f"{SPOTIFY_API_BASE}/v1/search", headers=auth_header(access_token), params={
+        "q": artist_name,
+        "type": "artist",
+        "limit": 5
+    })
+    if res.status_code != 200:
+        return None
+
+    best_id, best_score = None, 0.0
+    for artist in res.json().get("artists", {}).get("items", []):
+        score = similarity(artist["name"], artist_name)
+        if score >= ARTIST_THRESHOLD and score > best_score:
+            best_id, best_score = artist["id"], score
+    return best_id
+
+
+def fetch_artist_catalog(access_token, artist_name):
+    artist_id = find_artist_id(access_token, artist_name)
+    if not artist_id:
+        print(f"⚠️ Could not find {artist_name} on Spotify, falling back to search")
+        return None
+
+    albums, error = paginate(access_token, f"{SPOTIFY_API_BASE}/v1/artists/{artist_id}/albums",
+                             params={"include_groups": CATALOG_GROUPS}, page_size=50)
+    if error is not None:
+        print(f"⚠️ Could not fetch albums for {artist_name}: {error.status_code}")
+        return None
+
+    album_ids = [album["id"] for album in albums]
+    tracks = []
+    for i in range(0, len(album_ids), ALBUM_BATCH_SIZE):
+        res = http_client.get(f"{SPOTIFY_API_BASE}/v1/albums", headers=auth_header(access_token),
+                              params={"ids": ",".join(album_ids[i:i + ALBUM_BATCH_SIZE])})
+        if res.status_code != 200:
+            continue
+        for album in res.json().get("albums", []):
+            if not album:
+                continue
+            page = album.get("tracks", {})
+            tracks.extend(page.get("items", []))
+            # Albums with more than 50 tracks continue on their own paging object
+            if page.get("next"):
+                rest, error = paginate(access_token, f"{SPOTIFY_API_BASE}/v1/albums/{album['id']}/tracks",
+                                       page_size=50)
+                if error is None:
+                    tracks.extend(rest[len(page.get("items", [])):])
+
+    print(f"📀 Indexed {len(tracks)} tracks from {len(albums)} releases by {artist_name}")
+    return ArtistCatalog(artist_id, artist_name, tracks)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_artist_catalog(access_token, artist_name):
+    """Returns the artist's catalog, fetching it once per process and artist."""
+    key = normalize(artist_name)
+    with _catalogs_lock:
+        if key in _catalogs:
+            return _catalogs[key]
+    catalog = fetch_artist_catalog(access_token, artist_name)
+    with _catalogs_lock:
+        return _catalogs.setdefault(key, catalog)
@@ -1,81 +1,37 @@
-import requests
-from rich import print
-from rich.prompt import Prompt, Confirm
+# Load .env before the modules below read their settings from the environment
 from dotenv import load_dotenv
-import os
-from rich.prompt import Prompt
-from rich import print
-import sys
-
-from spotify_helper import get_spotify_token, get_current_user_id, extract_playlist_id, extract_playlist_id, add_songs_to_playlist, create_spotify_playlist
 load_dotenv()
 
-
-SETLIST_FM_API_KEY = os.getenv("SETLIST_FM_API_KEY")
-
-
-# Spotify Auth Step 1
-import os
-import json
-import time
 import argparse
-import re
-
-
-
-# Fetch setlist.fm data
-from rich.table import Table
-from rich.console import Console
-from rich.prompt import IntPrompt
-
-console = Console()
-
-import re
 
-def get_setlist_from_url(url):
-    print(f"[bold green]Fetching setlist from URL...[/bold green]")
-    
-    match = re.search(r'/setlist/.+/.*-([0-9a-f]+)\.html', url)
-    if not match:
-        print("[red]Invalid setlist.fm URL format.[/red]")
-        exit()
-
-    setlist_id = match.group(1)
-    headers = {
-        "x-api-key": SETLIST_FM_API_KEY,
-        "Accept": "application/json"
-    }
+from rich import print
 
-    res = requests.get(f"https://api.setlist.fm/rest/1.0/setlist/{setlist_id}", headers=headers)
+import http_client
+from metrics import metrics
+from http_client import SETLIST_FM_API_BASE
+from setlists import SETLIST_FM_API_KEY, SetlistError, get_setlist_from_url, parse_setlist, setlist_id_from_url
+from setlists import iter_setlists_from_file, iter_setlists_from_search
+from spotify_helper import get_spotify_token, get_token_manager, get_current_user_id, extract_playlist_id, add_songs_to_playlist, create_spotify_playlist
+from spotify_helper import get_playlist_uris, resolve_pairs, select_new_uris, add_uris_to_playlist, search_tier_stats, song_pairs
+from spotify_helper import sync_playlist, add_resolved_to_playlist, sync_resolved_to_playlist, failed_lookups, SpotifyError
+from cache import get_track_cache, get_playlist_index, get_sync_journal
+from catalog import get_artist_catalog
+from export import read_resolved, record_resolved, record_song, seed_track_cache, write_resolved_setlist
 
-    if res.status_code != 200:
-        print(f"[red]Failed to fetch setlist: {res.status_code}[/red]")
-        exit()
-
-    data = res.json()
-    try:
-        # Safely extract all songs from all sets
-        songs = []
-        for s in data.get("sets", {}).get("set", []):
-            for song in s.get("song", []):
-                name = song.get("name")
-                if name:
-                    songs.append(name)
-    except (KeyError, IndexError):
-        print("[red]This setlist has no valid songs.[/red]")
-        exit()
-
-    artist_name = data["artist"]["name"]
-    return songs, artist_name
 
 def get_setlist(artist, city):
+    # The table and prompt load most of rich, so they are only imported when actually shown
+    from rich.console import Console
+    from rich.prompt import IntPrompt
+    from rich.table import Table
+
     print(f"[bold green]Searching setlists for {artist} in {city}...[/bold green]")
     headers = {
         "x-api-key": SETLIST_FM_API_KEY,
         "Accept": "application/json"
     }
 
-    res = requests.get("https://api.setlist.fm/rest/1.0/search/setlists", headers=headers, params={
+    res = http_client.get(f"{SETLIST_FM_API_BASE}/search/setlists", headers=headers, params={
         "artistName": artist,
         "cityName": city,
         "p": 1
@@ -101,87 +57,263 @@ def get_setlist(artist, city):
         country = s.get("venue", {}).get("city", {}).get("country", {}).get("name", "")
         table.add_row(str(i), date, venue, f"{city}, {country}")
 
-    console.print(table)
+    Console().print(table)
 
     index = IntPrompt.ask("Select a setlist number", choices=[str(i) for i in range(1, len(setlists)+1)])
     selected = setlists[index - 1]
 
-    try:
-        # Safely extract all songs from all sets
-        songs = []
-        for s in data.get("sets", {}).get("set", []):
-            for song in s.get("song", []):
-                name = song.get("name")
-                if name:
-                    songs.append(name)
-    except (KeyError, IndexError):
-        print("[red]This setlist doesn't contain a valid set of songs.[/red]")
-        exit()
-
+    songs, _ = parse_setlist(selected)
     return songs
 
 
+def print_profile():
+    from rich.console import Console
+    from rich.table import Table
 
-def process_setlists_from_file(file_path, access_token, playlist_id):
-    try:
-        with open(file_path, "r") as f:
-            urls = [line.strip() for line in f if line.strip()]
-    except FileNotFoundError:
-        print(f"[red]❌ File not found: {file_path}[/red]")
-        return
+    table = Table(title="⏱️ Profile")
+    for column in ("Where", "What", "Calls", "Total s", "p50 ≤ s", "p95 ≤ s", "Retries", "Bytes"):
+        table.add_column(column, justify="left" if column in ("Where", "What") else "right")
+    for where, what, calls, total, p50, p95, retries, nbytes in metrics.summary_rows():
+        table.add_row(where, what, str(calls), f"{total:.2f}", f"{p50:g}", f"{p95:g}", str(retries), str(nbytes))
+    Console().print(table)
 
-    all_added = 0
+def print_resolution_stats():
+    stats = get_track_cache().stats()
+    print(f"[dim]Track cache: {stats['hits']} hits, {stats['misses']} misses[/dim]")
+    if search_tier_stats:
+        tiers = ", ".join(f"{tier}: {count}" for tier, count in search_tier_stats.most_common())
+        print(f"[dim]Search tiers: {tiers}[/dim]")
 
-    for url in urls:
-        try:
-            songs, artist_name = get_setlist_from_url(url)
-        except Exception as e:
-            print(f"[yellow]⚠️ Skipping invalid setlist: {url} — {e}[/yellow]")
-            continue
+def start_journal(playlist_id, resume=False):
+    """Returns the sync journal and the skip function for the setlist sources. Without
+    `resume` the playlist's journal is cleared and nothing is skipped."""
+    journal = get_sync_journal()
+    if not resume:
+        journal.clear(playlist_id)
+        return journal, None
 
-        if not songs:
-            print(f"[yellow]⚠️ No songs found in setlist: {url}[/yellow]")
-            continue
+    setlists, uris = journal.stats(playlist_id)
+    print(f"[dim]Resuming: {setlists} setlists and {uris} songs already added to this playlist[/dim]")
+    return journal, lambda setlist_id: journal.is_completed(playlist_id, setlist_id)
+
+
+def process_setlists_from_file(file_path, access_token, playlist_id, use_catalog=False, resume=False):
+    journal, skip = start_journal(playlist_id, resume)
+    process_setlists(iter_setlists_from_file(file_path, skip), access_token, playlist_id, use_catalog, journal)
+
+
+def process_setlists(setlists, access_token, playlist_id, use_catalog=False, journal=None):
+    """Adds each (setlist_id, url, songs, artist_name) setlist to the playlist as it arrives,
+    recording written songs and finished setlists in `journal`."""
+    all_added = 0
+    on_write = (lambda uris: journal.record_uris(playlist_id, uris)) if journal else None
 
+    for setlist_id, url, songs, artist_name in setlists:
         print(f"\n🎤 Adding {len(songs)} songs from [bold]{artist_name}[/bold]'s setlist...")
-        added = add_songs_to_playlist(access_token, songs, artist_name, playlist_id)
+        catalog = get_artist_catalog(access_token, artist_name) if use_catalog else None
+        added, failed = add_songs_to_playlist(access_token, songs, artist_name, playlist_id,
+                                              track_cache=get_track_cache(), playlist_index=get_playlist_index(),
+                                              catalog=catalog, on_write=on_write)
         all_added += added
+        # A setlist with songs that failed stays open, so --resume tries it again
+        if journal and not failed:
+            journal.complete(playlist_id, [setlist_id])
+        elif journal:
+            print(f"[yellow]⚠️ {failed} songs failed; --resume will retry this setlist.[/yellow]")
 
     print(f"\n[green]✅ Finished. Added {all_added} songs in total.[/green]")
+    print_resolution_stats()
 
 
+def resolve_setlists(setlists, access_token, use_catalog=False):
+    """Searches each distinct (artist, song) pair of the setlists once; returns {pair: (uri, label, ok)}."""
+    pairs = [pair for _, _, songs, artist_name in setlists for pair in song_pairs(songs, artist_name)]
+    unique_pairs = {pair for pair in pairs if pair[0]}
+    print(f"\n🔎 Resolving {len(unique_pairs)} unique songs from {len(pairs)} setlist entries...")
 
+    catalogs = None
+    if use_catalog:
+        artists = {artist_name for _, _, _, artist_name in setlists}
+        catalogs = {artist_name: get_artist_catalog(access_token, artist_name) for artist_name in artists}
 
-# Main CLI Flow
-import click
-from rich.prompt import Prompt
-from rich import print
-from rich.prompt import Confirm
+    return resolve_pairs(access_token, pairs, track_cache=get_track_cache(), catalogs=catalogs)
+
+
+def process_setlists_batched(setlists, access_token, playlist_id, use_catalog=False, journal=None):
+    """Like process_setlists, but collects every setlist first, searches each distinct
+    (artist, song) pair once and adds all new tracks in one set of 100-URI calls."""
+    setlists = list(setlists)
+    resolved = resolve_setlists(setlists, access_token, use_catalog)
+    existing_uris = get_playlist_uris(access_token, playlist_id, get_playlist_index())
 
-from rich.prompt import Prompt, Confirm
+    uris = []
+    for _, url, songs, artist_name in setlists:
+        print(f"\n🎤 {len(songs)} songs from [bold]{artist_name}[/bold]'s setlist {url}")
+        new_uris = select_new_uris(songs, [resolved[pair] for pair in song_pairs(songs, artist_name)], existing_uris)
+        print(f"   {len(new_uris)} new songs")
+        uris.extend(new_uris)
 
+    all_added = 0
+    if uris:
+        on_write = (lambda chunk: journal.record_uris(playlist_id, chunk)) if journal else None
+        all_added = add_uris_to_playlist(access_token, playlist_id, uris, get_playlist_index(), on_write)
+    else:
+        print("No new songs found to add.")
+
+    # Only a fully written batch counts as done, and only its setlists whose songs were all
+    # looked up; --resume redoes the rest
+    if journal and all_added == len(uris):
+        journal.complete(playlist_id, [
+            setlist_id for setlist_id, _, songs, artist_name in setlists
+            if not failed_lookups([resolved[pair] for pair in song_pairs(songs, artist_name)])
+        ])
+
+    print(f"\n[green]✅ Finished. Added {all_added} songs in total.[/green]")
+    print_resolution_stats()
+
+
+def print_sync_result(result):
+    if result["failed"]:
+        print(f"[yellow]⚠️ Sync stopped: {result['failed']} songs could not be looked up, "
+              f"so the playlist was left unchanged. Try again later.[/yellow]")
+        return
+    how = "rebuilt" if result["rebuilt"] else f"{result['moved']} moved"
+    color = "green" if result["ok"] else "yellow"
+    print(f"[{color}]🔁 Synced playlist: {result['added']} added, {result['removed']} removed, {how}.[/{color}]")
+
+
+def sync_setlists(setlists, access_token, playlist_id, use_catalog=False):
+    """Makes the playlist hold exactly the setlists' songs, in setlist order, removing everything else."""
+    setlists = list(setlists)
+    resolved = resolve_setlists(setlists, access_token, use_catalog)
+
+    uris, seen = [], set()
+    for _, url, songs, artist_name in setlists:
+        print(f"\n🎤 {len(songs)} songs from [bold]{artist_name}[/bold]'s setlist {url}")
+        uris.extend(select_new_uris(songs, [resolved[pair] for pair in song_pairs(songs, artist_name)], seen))
+
+    result = sync_playlist(access_token, playlist_id, uris, get_playlist_index(), failed_lookups(resolved.values()))
+    print_sync_result(result)
+    print_resolution_stats()
+
+
+def setlist_source(args, skip=None):
+    """The setlists named on the command line: one --setlist URL, a --file of URLs or every --artist setlist."""
+    if args.setlist:
+        songs, artist_name = get_setlist_from_url(args.setlist)
+        if not songs:
+            print("[yellow]⚠️ No songs found in setlist.[/yellow]")
+            return []
+        return [(setlist_id_from_url(args.setlist), args.setlist, songs, artist_name)]
+    if args.file:
+        return iter_setlists_from_file(args.file, skip)
+    return iter_setlists_from_search(args.artist, args.city, args.year, args.tour, skip)
+
+
+def export_setlists(setlists, access_token, path, use_catalog=False):
+    """Resolves each setlist and streams the results to a JSONL file that --import can replay."""
+    track_cache = get_track_cache()
+    exported = 0
+    with open(path, "w", encoding="utf-8") as out:
+        for setlist_id, url, songs, artist_name in setlists:
+            print(f"\n🎤 Resolving {len(songs)} songs from [bold]{artist_name}[/bold]'s setlist...")
+            catalogs = {artist_name: get_artist_catalog(access_token, artist_name)} if use_catalog else None
+            pairs = song_pairs(songs, artist_name)
+            resolved = resolve_pairs(access_token, pairs, track_cache=track_cache, catalogs=catalogs)
+            exported += write_resolved_setlist(out, setlist_id, artist_name, songs,
+                                               [resolved[pair] for pair in pairs], track_cache)
+
+    print(f"\n[green]✅ Exported {exported} setlist entries to {path}.[/green]")
+    print_resolution_stats()
+
+
+def import_setlists(path, access_token, playlist_id, sync=False):
+    """Adds (or with `sync`, syncs) the songs of an export file to the playlist without any searches."""
+    songs, resolved = [], []
+    for record in read_resolved(path):
+        songs.append(record_song(record))
+        resolved.append(record_resolved(record))
+    print(f"\n📥 Loaded {len(songs)} setlist entries from {path}")
+
+    if sync:
+        print_sync_result(sync_resolved_to_playlist(access_token, songs, resolved, playlist_id, get_playlist_index()))
+    else:
+        added = add_resolved_to_playlist(access_token, songs, resolved, playlist_id, get_playlist_index())
+        print(f"[green]✅ Added {added} songs to the playlist.[/green]")
+
+
+
+
+# Main CLI Flow
 def main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Add setlist.fm songs to a Spotify playlist.")
     parser.add_argument("--playlist", help="Spotify playlist URL")
     parser.add_argument("--file", help="Path to a text file with Setlist.fm URLs")
     parser.add_argument("--setlist", help="Single Setlist.fm URL")
+    parser.add_argument("--artist", help="Add every setlist.fm setlist of this artist (narrow with --city, --year, --tour)")
+    parser.add_argument("--city", help="With --artist: only setlists in this city")
+    parser.add_argument("--year", help="With --artist: only setlists from this year")
+    parser.add_argument("--tour", help="With --artist: only setlists from this tour")
+    parser.add_argument("--sync", action="store_true",
+                        help="Make the playlist match the setlists exactly: remove other songs and reorder")
+    parser.add_argument("--export", metavar="FILE",
+                        help="Resolve the --setlist, --file or --artist setlists into a JSONL file instead of a playlist")
+    parser.add_argument("--import", dest="import_file", metavar="FILE",
+                        help="Add the songs of an --export file to the playlist without searching")
+    parser.add_argument("--seed-cache", action="store_true",
+                        help="With --import: only load the file into the track cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="With --file or --artist: skip setlists already added to this playlist by an earlier run")
+    parser.add_argument("--batch", action="store_true",
+                        help="With --file or --artist: fetch all setlists first and search each song only once")
+    parser.add_argument("--catalog", action="store_true",
+                        help="Match songs against the artist's Spotify discography before searching")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print time spent per stage and per API endpoint when done")
     args = parser.parse_args()
 
-    access_token = get_spotify_token()
+    try:
+        run(args)
+    except (SetlistError, SpotifyError) as e:
+        print(f"[red]❌ {e}[/red]")
+    finally:
+        if args.profile:
+            print_profile()
+
+
+def run(args):
+
+    if args.import_file and args.seed_cache:
+        loaded = seed_track_cache(args.import_file, get_track_cache())
+        print(f"[green]✅ Loaded {loaded} resolved songs into the track cache.[/green]")
+        return
+
+    if args.export and not (args.setlist or args.file or args.artist):
+        print("[red]❌ --export needs --setlist, --file or --artist.[/red]")
+        return
+
+    get_spotify_token()
+    # Requests take their token from the manager, so a run can outlast the hour a token is valid
+    access_token = get_token_manager()
     user_id = get_current_user_id(access_token)
 
     if not user_id:
         print("[red]❌ Could not retrieve Spotify user ID.[/red]")
         return
 
+    if args.export:
+        export_setlists(setlist_source(args), access_token, args.export, args.catalog)
+        return
+
     if args.playlist:
         playlist_id = extract_playlist_id(args.playlist)
         if not playlist_id:
             print("[red]❌ Invalid Spotify playlist URL.[/red]")
             return
     else:
-        
+        from rich.prompt import Confirm, Prompt
+
         # Ask whether to create a new playlist or use an existing one
         create_new = Confirm.ask("Do you want to create a new Spotify playlist?", default=False)
 
@@ -196,23 +328,39 @@ def main():
             playlist_id = Prompt.ask("Enter existing Spotify playlist ID")
             playlist_id = extract_playlist_id(playlist_id)
 
-    if args.setlist:
+    if args.import_file:
+        import_setlists(args.import_file, access_token, playlist_id, args.sync)
+
+    elif args.setlist:
         # Use single setlist from CLI
         setlist_url = args.setlist
         songs, artist_name = get_setlist_from_url(setlist_url)
         if not songs:
             print("[yellow]⚠️ No songs found in setlist.[/yellow]")
             return
+        if args.sync:
+            sync_setlists([(None, setlist_url, songs, artist_name)], access_token, playlist_id, args.catalog)
+            return
         print(f"\n🎤 Adding {len(songs)} songs from [bold]{artist_name}[/bold]'s setlist...")
-        added = add_songs_to_playlist(access_token, songs, artist_name, playlist_id)
+        catalog = get_artist_catalog(access_token, artist_name) if args.catalog else None
+        added, _ = add_songs_to_playlist(access_token, songs, artist_name, playlist_id,
+                                         track_cache=get_track_cache(), playlist_index=get_playlist_index(),
+                                         catalog=catalog)
         print(f"[green]✅ Added {added} songs to the playlist.[/green]")
 
-    elif args.file:
-        # Use file of setlists from CLI
-        process_setlists_from_file(args.file, access_token, playlist_id)
+    elif args.file or args.artist:
+        # Use file of setlists, or every setlist found for the artist
+        journal, skip = (None, None) if args.sync else start_journal(playlist_id, args.resume)
+        setlists = setlist_source(args, skip)
+        if args.sync:
+            sync_setlists(setlists, access_token, playlist_id, args.catalog)
+        elif args.batch:
+            process_setlists_batched(setlists, access_token, playlist_id, args.catalog, journal)
+        else:
+            process_setlists(setlists, access_token, playlist_id, args.catalog, journal)
 
     else:
-
+        from rich.prompt import Prompt
 
         # Ask whether user wants to add from a single URL or a file
         mode = Prompt.ask(
@@ -233,7 +381,8 @@ def main():
                 return
 
             print(f"\n🎤 Adding {len(songs)} songs from [bold]{artist_name}[/bold]'s setlist...")
-            added = add_songs_to_playlist(access_token, songs, artist_name, playlist_id)
+            added, _ = add_songs_to_playlist(access_token, songs, artist_name, playlist_id,
+                                             track_cache=get_track_cache(), playlist_index=get_playlist_index())
             print(f"[green]✅ Added {added} songs to the playlist.[/green]")
 
         elif mode == "file":
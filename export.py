@@ -0,0 +1,74 @@
+import json
+
+from spotify_helper import search_artist, song_name
+
+# Export files hold one JSON object per setlist entry, in setlist order:
+# setlist_id, artist, song, cover, tape, uri, label, score (null when unknown)
+# and ok, which is false when the song's search failed rather than found nothing.
+
+
+def song_record(setlist_id, artist_name, song, resolved, track_cache=None):
+    """Builds the exported record of one setlist entry; `resolved` is its (uri, artists label, ok)."""
+    uri, label, ok = resolved
+    score = None
+    searched_as = search_artist(song, artist_name)
+    if track_cache is not None and uri and searched_as:
+        cached = track_cache.peek(searched_as, song_name(song))
+        if cached and cached[0] == uri:
+            score = cached[2]
+    return {
+        "setlist_id": setlist_id,
+        "artist": artist_name,
+        "song": song_name(song),
+        "cover": None if isinstance(song, str) else song.get("cover"),
+        "tape": False if isinstance(song, str) else song.get("tape", False),
+        "uri": uri,
+        "label": label,
+        "score": round(score, 3) if score is not None else None,
+        "ok": ok,
+    }
+
+
+def write_resolved_setlist(out, setlist_id, artist_name, songs, resolved, track_cache=None):
+    """Appends one setlist's entries to an open export file; returns the number of lines written."""
+    for song, result in zip(songs, resolved):
+        record = song_record(setlist_id, artist_name, song, result, track_cache)
+        out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+    return len(songs)
+
+
+def read_resolved(path):
+    """Yields the records of an export file, one line at a time."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def record_song(record):
+    """The song record (as setlists.parse_setlist builds it) behind an exported entry."""
+    return {"name": record["song"], "cover": record.get("cover"), "tape": record.get("tape", False), "info": None}
+
+
+def record_resolved(record):
+    """The (uri, artists label, ok) result behind an exported entry. Files written before
+    `ok` was exported cannot tell a miss from a failed search, so their misses count as failed."""
+    ok = record.get("ok")
+    if ok is None:
+        ok = bool(record["uri"]) or search_artist(record_song(record), record["artist"]) is None
+    return record["uri"], record["label"], ok
+
+
+def seed_track_cache(path, track_cache):
+    """Loads every searched entry of an export file into the track cache; returns the number loaded.
+
+    Entries whose search failed are left out, so they are searched again
+    instead of being cached as "not found" for TRACK_CACHE_NEGATIVE_TTL.
+    """
+    loaded = 0
+    for record in read_resolved(path):
+        searched_as = search_artist(record_song(record), record["artist"])
+        if searched_as and record_resolved(record)[2]:
+            track_cache.put(searched_as, record["song"], record["uri"], record["label"], record["score"])
+            loaded += 1
+    return loaded
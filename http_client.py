@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import metrics
+
+# API roots; overridable so the client can be pointed at a local stand-in (see bench/)
+SPOTIFY_API_BASE = os.getenv("SPOTIFY_API_BASE", "https://api.spotify.com")
+SPOTIFY_ACCOUNTS_BASE = os.getenv("SPOTIFY_ACCOUNTS_BASE", "https://accounts.spotify.com")
+SETLIST_FM_API_BASE = os.getenv("SETLIST_FM_API_BASE", "https://api.setlist.fm/rest/1.0")
+
+# Connection pool and retry settings shared by every Spotify and setlist.fm call
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 15))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+
+# Requests per second allowed per API host, shared by every thread in the process
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", 10))
+SETLIST_FM_RATE_LIMIT = float(os.getenv("SETLIST_FM_RATE_LIMIT", 2))
+RATE_LIMITS = {
+    urlparse(SPOTIFY_API_BASE).netloc: SPOTIFY_RATE_LIMIT,
+    urlparse(SETLIST_FM_API_BASE).netloc: SETLIST_FM_RATE_LIMIT,
+}
+# How often a 429 is retried, and the longest Retry-After we are willing to wait out
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", 5))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 120))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Spaces out requests to one host; `pause` blocks every caller after a 429."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.blocked_until
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(url):
+    """Returns the shared token bucket for the host of `url`, or None if it is not rate limited."""
+    host = urlparse(url).netloc
+    rate = RATE_LIMITS.get(host)
+    if not rate:
+        return None
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = _buckets[host] = TokenBucket(rate)
+        return bucket
+
+
+def _retry_after(response, attempt):
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return BACKOFF_FACTOR * (2 ** attempt)
+
+
+def _make_session():
+    # Only requests that can safely be repeated are retried after a 5xx, which
+    # may come back for a change Spotify already applied. POST is left out
+    # because a playlist add would append the same tracks twice, and PUT
+    # because a reorder (range_start/insert_before) would move a different
+    # track the second time. DELETE by URI removes nothing more when
+    # repeated. Failed connections are still retried for every method,
+    # since nothing reached the server.
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "DELETE", "OPTIONS"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url):
+    """Returns the keep-alive session for the host of `url`, creating it on first use."""
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _make_session()
+        return session
+
+
+def _urllib3_retries(response):
+    retries = getattr(response.raw, "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    started = time.perf_counter()
+    try:
+        response, retries = _send_with_rate_limit(method, url, **kwargs)
+    except requests.RequestException:
+        metrics.record_request(method, url, "error", time.perf_counter() - started)
+        raise
+    metrics.record_request(method, url, response.status_code, time.perf_counter() - started,
+                           retries=retries, nbytes=len(response.content))
+    return response
+
+
+def _send_with_rate_limit(method, url, **kwargs):
+    """Sends a request, waiting out 429s; returns (response, number of retries)."""
+    session = get_session(url)
+    bucket = get_bucket(url)
+    retries = 0
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if bucket is not None:
+            bucket.acquire()
+        response = session.request(method, url, **kwargs)
+        retries += _urllib3_retries(response)
+        if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            return response, retries
+
+        delay = _retry_after(response, attempt)
+        if delay > RATE_LIMIT_MAX_WAIT:
+            return response, retries
+        retries += 1
+        if bucket is not None:
+            bucket.pause(delay)
+        else:
+            time.sleep(delay)
+
+    return response, retries
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
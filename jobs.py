@@ -0,0 +1,257 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Web sync jobs run on a fixed pool of worker threads fed by a bounded queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", 32))
+# Where job progress is kept: "memory" (per process) or "sqlite" (shared by all gunicorn workers)
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", ".jobs.db")
+JOB_STORE_MAX_ENTRIES = int(os.getenv("JOB_STORE_MAX_ENTRIES", 1000))
+# Jobs are forgotten this many seconds after their last update
+JOB_TTL = int(os.getenv("JOB_TTL", 3600))
+
+
+class JobExecutor:
+    """Fixed-size worker pool with a bounded backlog.
+
+    `submit` never blocks: it returns False when the backlog is full so the
+    caller can reject the request instead of piling up threads.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, queue_depth=JOB_QUEUE_DEPTH):
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(maxsize=max(1, queue_depth))
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"sync-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"❌ Job failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args):
+        self._start()
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            return False
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+
+class _SharedCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.listeners = []
+        self.last_progress = None
+        self.result = None
+        self.error = None
+
+
+class SharedWork:
+    """Coalesces identical in-flight work across jobs.
+
+    The first `run` for a key calls `fn`; jobs asking for the same key while
+    it is running wait for it and get the same result (or exception) instead
+    of repeating the work. `fn` receives a progress callback that is fanned
+    out to the progress callbacks of every waiting job.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _progress(self, call, *progress):
+        with self._lock:
+            call.last_progress = progress
+            listeners = list(call.listeners)
+        for listener in listeners:
+            listener(*progress)
+
+    def run(self, key, fn, progress_callback=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _SharedCall()
+            if progress_callback:
+                call.listeners.append(progress_callback)
+            last_progress = call.last_progress
+
+        if not leader:
+            # Catch up with the running call before waiting for it
+            if progress_callback and last_progress:
+                progress_callback(*last_progress)
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(lambda *progress: self._progress(call, *progress))
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class MemoryJobStore:
+    """In-process job state with LRU and TTL eviction."""
+
+    def __init__(self, max_entries=JOB_STORE_MAX_ENTRIES, ttl=JOB_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._jobs = OrderedDict()  # task_id -> (updated_at, state)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _evict(self, now):
+        while self._jobs:
+            task_id, (updated_at, _) = next(iter(self._jobs.items()))
+            if len(self._jobs) <= self.max_entries and now - updated_at < self.ttl:
+                break
+            del self._jobs[task_id]
+
+    def get(self, task_id):
+        with self._lock:
+            entry = self._jobs.get(task_id)
+            if entry is None or time.time() - entry[0] >= self.ttl:
+                return None
+            return dict(entry[1])
+
+    def set(self, task_id, state):
+        now = time.time()
+        with self._lock:
+            self._jobs[task_id] = (now, dict(state))
+            self._jobs.move_to_end(task_id)
+            self._evict(now)
+            self._changed.notify_all()
+
+    def update(self, task_id, fields):
+        now = time.time()
+        with self._lock:
+            _, state = self._jobs.get(task_id, (now, {}))
+            state = {**state, **fields}
+            self._jobs[task_id] = (now, state)
+            self._jobs.move_to_end(task_id)
+            self._evict(now)
+            self._changed.notify_all()
+
+    def delete(self, task_id):
+        with self._lock:
+            self._jobs.pop(task_id, None)
+            self._changed.notify_all()
+
+    def wait_for_change(self, task_id, last_state, timeout):
+        """Blocks until the job's state differs from `last_state` or `timeout` passes; returns the state."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                entry = self._jobs.get(task_id)
+                state = dict(entry[1]) if entry else None
+                remaining = deadline - time.monotonic()
+                if state != last_state or remaining <= 0:
+                    return state
+                self._changed.wait(remaining)
+
+
+class SqliteJobStore:
+    """Job state in a SQLite file, visible to every worker process on the host."""
+
+    def __init__(self, path=JOB_STORE_PATH, ttl=JOB_TTL, table="jobs"):
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (task_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_updated_at ON {table} (updated_at)")
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT state FROM {self.table} WHERE task_id = ? AND updated_at > ?", (task_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, task_id, fields, merge):
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so a read-modify-write
+            # cannot interleave with another worker process
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = {}
+                if merge:
+                    row = self._conn.execute(f"SELECT state FROM {self.table} WHERE task_id = ?", (task_id,)).fetchone()
+                    state = json.loads(row[0]) if row else {}
+                state.update(fields)
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (task_id, state, updated_at) VALUES (?, ?, ?)",
+                    (task_id, json.dumps(state), now)
+                )
+                self._conn.execute(f"DELETE FROM {self.table} WHERE updated_at < ?", (now - self.ttl,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def set(self, task_id, state):
+        self._write(task_id, state, merge=False)
+
+    def update(self, task_id, fields):
+        self._write(task_id, fields, merge=True)
+
+    def delete(self, task_id):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE task_id = ?", (task_id,))
+
+    def wait_for_change(self, task_id, last_state, timeout, interval=0.25):
+        # Updates may come from another process, so there is nothing to wait on but the file
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self.get(task_id)
+            if state != last_state or time.monotonic() >= deadline:
+                return state
+            time.sleep(interval)
+
+
+def make_job_store(kind=JOB_STORE, ttl=JOB_TTL, table="jobs"):
+    """`table` keeps unrelated records apart in the shared SQLite file, each with its own TTL."""
+    if kind == "sqlite":
+        return SqliteJobStore(ttl=ttl, table=table)
+    if kind == "memory":
+        return MemoryJobStore(ttl=ttl)
+    raise ValueError(f"Unknown JOB_STORE: {kind}")
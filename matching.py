@@ -0,0 +1,92 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# A candidate must reach both thresholds to be accepted
+ARTIST_THRESHOLD = 0.8
+TITLE_THRESHOLD = 0.6
+# Versions we do not want unless the setlist asked for them
+UNWANTED_VERSIONS = ("live", "karaoke", "instrumental", "remix", "demo", "acoustic", "commentary", "8-bit")
+VERSION_PENALTY = 0.3
+
+# "- Remastered 2011", "- Live at Wembley", "- Radio Edit", ...
+_SUFFIX_RE = re.compile(r"\s+-\s+.*$")
+# "(feat. X)", "[Live]", "(2011 Remaster)", ...
+_BRACKETS_RE = re.compile(r"[\(\[].*?[\)\]]")
+_FEAT_RE = re.compile(r"\b(feat|ft|featuring)\b\.?.*$")
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+
+
+@lru_cache(maxsize=65536)
+def fold(text):
+    """Lowercases and strips accents: "Sigur Rós" -> "sigur ros"."""
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+@lru_cache(maxsize=65536)
+def normalize(text):
+    """Reduces a title or artist name to its comparable core."""
+    text = fold(text).replace("&", " and ")
+    text = _SUFFIX_RE.sub("", text)
+    text = _BRACKETS_RE.sub(" ", text)
+    text = _FEAT_RE.sub("", text)
+    text = _NON_WORD_RE.sub(" ", text)
+    words = text.split()
+    if len(words) > 1 and words[0] == "the":
+        words = words[1:]
+    return " ".join(words)
+
+
+@lru_cache(maxsize=65536)
+def _bigrams(text):
+    text = text.replace(" ", "")
+    if len(text) < 2:
+        return frozenset([text])
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+
+def _comparable(text):
+    # Titles that are nothing but brackets ("(Intro)") normalize to "", which would equal every other such title
+    return normalize(text) or fold(text).strip()
+
+
+def similarity(a, b):
+    """Dice coefficient over character bigrams of the normalized strings (0..1)."""
+    a, b = _comparable(a), _comparable(b)
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    grams_a, grams_b = _bigrams(a), _bigrams(b)
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+@lru_cache(maxsize=65536)
+def version_tags(text):
+    folded = fold(text)
+    return frozenset(tag for tag in UNWANTED_VERSIONS if re.search(rf"\b{re.escape(tag)}\b", folded))
+
+
+def score_track(track, song, artist_name):
+    """Scores a Spotify track object against a setlist song; returns (score, artist score, title score)."""
+    artist_score = max((similarity(artist["name"], artist_name) for artist in track["artists"]), default=0.0)
+    title_score = similarity(track["name"], song)
+
+    score = 0.6 * title_score + 0.4 * artist_score
+    # Prefer the studio version unless the setlist entry names a specific version
+    if version_tags(track["name"]) - version_tags(song):
+        score -= VERSION_PENALTY
+    return score, artist_score, title_score
+
+
+def best_match(tracks, song, artist_name):
+    """Returns (track, score) for the best acceptable candidate, or (None, 0.0)."""
+    best, best_score = None, 0.0
+    for track in tracks:
+        score, artist_score, title_score = score_track(track, song, artist_name)
+        if artist_score < ARTIST_THRESHOLD or title_score < TITLE_THRESHOLD:
+            continue
+        if score > best_score:
+            best, best_score = track, score
+    return best, best_score
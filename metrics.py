@@ -0,0 +1,146 @@
+import functools
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+# Histogram buckets in seconds, shared by HTTP requests and stages
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# IDs in Spotify and setlist.fm paths are replaced so each endpoint is one series
+_ID_SEGMENT_RE = re.compile(r"/(playlists|users|artists|albums|setlist)/[^/]+")
+
+
+def endpoint_template(url):
+    return _ID_SEGMENT_RE.sub(r"/\1/{id}", urlparse(url).path)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        """Upper bucket bound below which a fraction `q` of observations fall."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        for bound, count in zip(BUCKETS, self.counts):
+            if count >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Process-wide counters for outbound HTTP calls and pipeline stages."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.requests = {}   # (host, method, endpoint, status) -> count
+        self.retries = {}    # (host, method, endpoint) -> count
+        self.bytes = {}      # (host, method, endpoint) -> response bytes
+        self.latency = {}    # (host, method, endpoint) -> Histogram
+        self.stages = {}     # stage -> Histogram
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def record_request(self, method, url, status, seconds, retries=0, nbytes=0):
+        key = (urlparse(url).netloc, method, endpoint_template(url))
+        with self._lock:
+            status_key = key + (str(status),)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.retries[key] = self.retries.get(key, 0) + retries
+            self.bytes[key] = self.bytes.get(key, 0) + nbytes
+            self.latency.setdefault(key, Histogram()).observe(seconds)
+
+    def record_stage(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def render_prometheus(self):
+        lines = []
+
+        def labels(**values):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in values.items()) + "}"
+
+        def histogram(name, series):
+            lines.append(f"# TYPE {name} histogram")
+            for label_values, hist in series:
+                for bound, count in zip(BUCKETS, hist.counts):
+                    lines.append(f"{name}_bucket{labels(**label_values, le=bound)} {count}")
+                lines.append(f'{name}_bucket{labels(**label_values, le="+Inf")} {hist.count}')
+                lines.append(f"{name}_sum{labels(**label_values)} {hist.total:.6f}")
+                lines.append(f"{name}_count{labels(**label_values)} {hist.count}")
+
+        with self._lock:
+            lines.append("# HELP setlist_http_requests_total Outbound HTTP requests by endpoint and status.")
+            lines.append("# TYPE setlist_http_requests_total counter")
+            for (host, method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f"setlist_http_requests_total"
+                             f"{labels(host=host, method=method, endpoint=endpoint, status=status)} {count}")
+
+            lines.append("# HELP setlist_http_retries_total Retries after 429, 5xx or connection errors.")
+            lines.append("# TYPE setlist_http_retries_total counter")
+            for (host, method, endpoint), count in sorted(self.retries.items()):
+                lines.append(f"setlist_http_retries_total{labels(host=host, method=method, endpoint=endpoint)} {count}")
+
+            lines.append("# HELP setlist_http_response_bytes_total Response body bytes received.")
+            lines.append("# TYPE setlist_http_response_bytes_total counter")
+            for (host, method, endpoint), count in sorted(self.bytes.items()):
+                lines.append(f"setlist_http_response_bytes_total"
+                             f"{labels(host=host, method=method, endpoint=endpoint)} {count}")
+
+            lines.append("# HELP setlist_http_request_duration_seconds Outbound HTTP latency, retries included.")
+            histogram("setlist_http_request_duration_seconds", [
+                ({"host": host, "method": method, "endpoint": endpoint}, hist)
+                for (host, method, endpoint), hist in sorted(self.latency.items())
+            ])
+
+            lines.append("# HELP setlist_stage_duration_seconds Time spent per pipeline stage call.")
+            histogram("setlist_stage_duration_seconds", [
+                ({"stage": stage}, hist) for stage, hist in sorted(self.stages.items())
+            ])
+
+        return "\n".join(lines) + "\n"
+
+    def summary_rows(self):
+        """Rows for the CLI --profile table: ("stage" or host, name, calls, total s, p50 s, p95 s, retries, bytes)."""
+        rows = []
+        with self._lock:
+            for stage, hist in sorted(self.stages.items(), key=lambda kv: -kv[1].total):
+                rows.append(("stage", stage, hist.count, hist.total, hist.quantile(0.5), hist.quantile(0.95), "", ""))
+            for key, hist in sorted(self.latency.items(), key=lambda kv: -kv[1].total):
+                host, method, endpoint = key
+                rows.append((host, f"{method} {endpoint}", hist.count, hist.total, hist.quantile(0.5),
+                             hist.quantile(0.95), self.retries.get(key, 0), self.bytes.get(key, 0)))
+        return rows
+
+
+metrics = Metrics()
+
+
+def timed(stage):
+    """Decorator recording each call of the function as one observation of `stage`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.record_stage(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
@@ -0,0 +1,201 @@
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from rich import print
+
+import http_client
+from cache import get_setlist_cache
+from http_client import SETLIST_FM_API_BASE, SETLIST_FM_RATE_LIMIT
+from matching import ARTIST_THRESHOLD, similarity
+from metrics import timed
+
+SETLIST_FM_API_KEY = os.getenv("SETLIST_FM_API_KEY")
+# Search result pages fetched at once; the setlist.fm rate limit still applies
+SETLIST_SEARCH_CONCURRENCY = int(os.getenv("SETLIST_SEARCH_CONCURRENCY", max(1, int(SETLIST_FM_RATE_LIMIT))))
+
+
+class SetlistError(Exception):
+    """A setlist could not be read: bad URL, failed request or no usable songs."""
+
+
+def parse_setlist(data):
+    """Returns (songs, artist_name). Each song is a record with the title, the original
+    artist when it is a cover, whether it was played from tape, and setlist.fm's note."""
+    try:
+        # Safely extract all songs from all sets
+        songs = []
+        for s in data.get("sets", {}).get("set", []):
+            for song in s.get("song", []):
+                name = song.get("name")
+                if name:
+                    songs.append({
+                        "name": name,
+                        "cover": (song.get("cover") or {}).get("name"),
+                        "tape": bool(song.get("tape")),
+                        "info": song.get("info"),
+                    })
+    except (KeyError, IndexError):
+        raise SetlistError("This setlist has no valid songs.")
+
+    artist_name = data["artist"]["name"]
+    return songs, artist_name
+
+
+def setlist_id_from_url(url):
+    match = re.search(r'/setlist/.+/.*-([0-9a-f]+)\.html', url)
+    return match.group(1) if match else None
+
+
+@timed("fetch_setlist")
+def get_setlist_from_url(url):
+    print(f"[bold green]Fetching setlist from URL...[/bold green]")
+    
+    setlist_id = setlist_id_from_url(url)
+    if not setlist_id:
+        raise SetlistError("Invalid setlist.fm URL format.")
+
+    setlist_cache = get_setlist_cache()
+    cached = setlist_cache.get(setlist_id)
+    if cached and cached["fresh"]:
+        return parse_setlist(cached["body"])
+
+    headers = {
+        "x-api-key": SETLIST_FM_API_KEY,
+        "Accept": "application/json"
+    }
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    res = http_client.get(f"{SETLIST_FM_API_BASE}/setlist/{setlist_id}", headers=headers)
+
+    if res.status_code == 304 and cached:
+        setlist_cache.touch(setlist_id)
+        return parse_setlist(cached["body"])
+
+    if res.status_code != 200:
+        raise SetlistError(f"Failed to fetch setlist: {res.status_code}")
+
+    data = res.json()
+    songs, artist_name = parse_setlist(data)
+    setlist_cache.put(setlist_id, data, res.headers.get("ETag"), res.headers.get("Last-Modified"))
+    return songs, artist_name
+
+
+def fetch_setlist_page(params, page):
+    """Returns one page of /search/setlists, or None when there are no (more) results."""
+    headers = {
+        "x-api-key": SETLIST_FM_API_KEY,
+        "Accept": "application/json"
+    }
+    res = http_client.get(f"{SETLIST_FM_API_BASE}/search/setlists", headers=headers, params={**params, "p": page})
+    # setlist.fm answers 404 when a search has no results
+    if res.status_code == 404:
+        return None
+    if res.status_code != 200:
+        print(f"[yellow]⚠️ Failed to fetch setlist search page {page}: {res.status_code}[/yellow]")
+        return None
+    return res.json()
+
+
+def search_setlists(artist, city=None, year=None, tour=None, concurrency=SETLIST_SEARCH_CONCURRENCY):
+    """Yields every setlist matching the filters. After the first page, which gives the
+    total, pages are fetched `concurrency` at a time and only a few pages ahead of the
+    consumer, so results stream into the sync while the rest are still downloading."""
+    params = {"artistName": artist}
+    if city:
+        params["cityName"] = city
+    if year:
+        params["year"] = year
+    if tour:
+        params["tourName"] = tour
+
+    first = fetch_setlist_page(params, 1)
+    if not first:
+        return
+    yield from first.get("setlist", [])
+
+    per_page = first.get("itemsPerPage") or 20
+    last_page = -(-first.get("total", 0) // per_page)
+    pages = iter(range(2, last_page + 1))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque(executor.submit(fetch_setlist_page, params, page)
+                        for page in islice(pages, concurrency))
+        while pending:
+            data = pending.popleft().result()
+            page = next(pages, None)
+            if page is not None:
+                pending.append(executor.submit(fetch_setlist_page, params, page))
+            if data:
+                yield from data.get("setlist", [])
+
+
+def iter_setlists_from_search(artist, city=None, year=None, tour=None, skip=None):
+    """Yields (setlist_id, url, songs, artist_name) for the artist's setlists, caching each
+    one so a later run with --setlist or --file does not fetch it again. Setlists for
+    which `skip(setlist_id)` is true are left out."""
+    setlist_cache = get_setlist_cache()
+    found = skipped = 0
+    for data in search_setlists(artist, city, year, tour):
+        # artistName is a loose search; leave out setlists of similarly named artists
+        if similarity(data.get("artist", {}).get("name", ""), artist) < ARTIST_THRESHOLD:
+            continue
+        setlist_cache.put(data["id"], data)
+        songs, artist_name = parse_setlist(data)
+        if not songs:
+            continue
+        found += 1
+        if skip and skip(data["id"]):
+            skipped += 1
+            continue
+        yield data["id"], data.get("url", data["id"]), songs, artist_name
+
+    if not found:
+        print(f"[yellow]⚠️ No setlists with songs found for {artist}.[/yellow]")
+    if skipped:
+        print(f"[dim]Skipped {skipped} setlists completed in an earlier run[/dim]")
+
+
+def iter_setlists_from_file(file_path, skip=None):
+    """Yields (setlist_id, url, songs, artist_name) for each setlist URL in the file.
+
+    The file is read line by line, so its size does not matter. Setlists for
+    which `skip(setlist_id)` is true are not fetched.
+    """
+    try:
+        f = open(file_path, "r")
+    except FileNotFoundError:
+        print(f"[red]❌ File not found: {file_path}[/red]")
+        return
+
+    skipped = 0
+    with f:
+        for line in f:
+            url = line.strip()
+            if not url:
+                continue
+            setlist_id = setlist_id_from_url(url)
+            if not setlist_id:
+                print(f"[yellow]⚠️ Skipping invalid setlist URL: {url}[/yellow]")
+                continue
+            if skip and skip(setlist_id):
+                skipped += 1
+                continue
+
+            try:
+                songs, artist_name = get_setlist_from_url(url)
+            except Exception as e:
+                print(f"[yellow]⚠️ Skipping invalid setlist: {url} — {e}[/yellow]")
+                continue
+
+            if not songs:
+                print(f"[yellow]⚠️ No songs found in setlist: {url}[/yellow]")
+                continue
+            yield setlist_id, url, songs, artist_name
+
+    if skipped:
+        print(f"[dim]Skipped {skipped} setlists completed in an earlier run[/dim]")
@@ -1,23 +1,43 @@
 import os
-import json
 import time
 import base64
 import re
-import requests
+import http_client
+from metrics import timed
+from http_client import SPOTIFY_API_BASE, SPOTIFY_ACCOUNTS_BASE
+from tokens import TokenManager, auth_header, token_data
 from urllib.parse import urlencode
-import base64
-import json
-import time
-from rich.prompt import Prompt
-import sys
-from dotenv import load_dotenv  # Add this
-
-load_dotenv()  # Add this immediately
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+import threading
+import queue
+import requests
 
 REDIRECT_URI = os.getenv("REDIRECT_URI")
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 TOKEN_FILE = ".spotify_token.json"
+# Number of Spotify searches in flight at once per setlist
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 8))
+# Number of page requests in flight when downloading a large playlist
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", 4))
+# Only the fields we need when reading playlist contents
+PLAYLIST_TRACK_FIELDS = "items(track(uri,name))"
+
+# Seconds without a newly found song before a partial chunk is written
+WRITE_IDLE_FLUSH = float(os.getenv("WRITE_IDLE_FLUSH", 2))
+WRITE_RETRIES = int(os.getenv("WRITE_RETRIES", 2))
+WRITE_RETRY_DELAY = 1.0
+# Tape entries (intros and outros played from a recording) are skipped unless this is set,
+# in which case those whose recording artist setlist.fm knows are searched under that artist
+INCLUDE_TAPES = os.getenv("INCLUDE_TAPES", "").lower() in ("1", "true", "yes")
+
+_token_manager = None
+_token_manager_lock = threading.Lock()
+
+
+class SpotifyError(Exception):
+    """A Spotify request the sync cannot continue without failed."""
 
 
 #def extract_playlist_id(url):
@@ -25,30 +45,32 @@ TOKEN_FILE = ".spotify_token.json"
 #    match = re.search(r"playlist/([a-zA-Z0-9]+)", url)
 #    return match.group(1) if match else None
 
+def get_token_manager():
+    global _token_manager
+    with _token_manager_lock:
+        if _token_manager is None:
+            _token_manager = TokenManager(refresh_token, path=TOKEN_FILE)
+        return _token_manager
+
+
 def get_spotify_token():
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, "r") as f:
-            tokens = json.load(f)
-            # Check expiration
-            if time.time() < tokens["expires_at"]:
-                return tokens["access_token"]
-            else:
-                # Try to refresh
-                refreshed = refresh_token(tokens["refresh_token"])
-                if refreshed:
-                    return refreshed
-                else:
-                    print("[red]Failed to refresh token. Re-authenticating...[/red]")
+    manager = get_token_manager()
+    access_token = manager.get_access_token()
+    if access_token:
+        return access_token
+    if manager.tokens:
+        print("[red]Failed to refresh token. Re-authenticating...[/red]")
 
     # If no token or refresh fails, do full auth
     return authorize_user()
 
 
 def refresh_token(refresh_token):
+    """Exchanges a refresh token for a new token record, or returns None."""
     auth_str = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
     b64_auth = base64.b64encode(auth_str.encode()).decode()
 
-    res = requests.post("https://accounts.spotify.com/api/token", data={
+    res = http_client.post(f"{SPOTIFY_ACCOUNTS_BASE}/api/token", data={
         "grant_type": "refresh_token",
         "refresh_token": refresh_token
     }, headers={
@@ -56,21 +78,25 @@ def refresh_token(refresh_token):
     })
 
     if res.status_code == 200:
-        data = res.json()
-        access_token = data["access_token"]
-        expires_in = data.get("expires_in", 3600)
-        new_token = {
-            "access_token": access_token,
-            "refresh_token": refresh_token,  # Keep the original
-            "expires_at": time.time() + expires_in - 30
-        }
-        with open(TOKEN_FILE, "w") as f:
-            json.dump(new_token, f)
-        return access_token
+        return token_data(res.json(), refresh_token)  # Keep the original unless Spotify rotated it
     else:
         return None
 
 
+def exchange_code(code):
+    """Exchanges an authorization code; returns (token record or None, response)."""
+    res = http_client.post(f"{SPOTIFY_ACCOUNTS_BASE}/api/token", data={
+        "grant_type": "authorization_code",
+        "code": code,
+        "redirect_uri": REDIRECT_URI,
+        "client_id": SPOTIFY_CLIENT_ID,
+        "client_secret": SPOTIFY_CLIENT_SECRET
+    })
+    if res.status_code == 200:
+        return token_data(res.json()), res
+    return None, res
+
+
 def authorize_user():
     params = {
     "client_id": SPOTIFY_CLIENT_ID,
@@ -80,36 +106,18 @@ def authorize_user():
 }
     # ADD THIS DEBUG PRINT
     print(f"\n DEBUG: Sending Redirect URI: {REDIRECT_URI}")
-    auth_url = f"https://accounts.spotify.com/authorize?{urlencode(params)}"
+    auth_url = f"{SPOTIFY_ACCOUNTS_BASE}/authorize?{urlencode(params)}"
 
     print("\n[bold blue]Open this URL in your browser to authenticate with Spotify:[/bold blue]")
     print(auth_url)
+    from rich.prompt import Prompt
     code = Prompt.ask("\nPaste the code from the URL after login")
 
-    res = requests.post("https://accounts.spotify.com/api/token", data={
-        "grant_type": "authorization_code",
-        "code": code,
-        "redirect_uri": REDIRECT_URI,
-        "client_id": SPOTIFY_CLIENT_ID,
-        "client_secret": SPOTIFY_CLIENT_SECRET
-    })
-
-    if res.status_code == 200:
-        data = res.json()
-        access_token = data["access_token"]
-        refresh_token_val = data["refresh_token"]
-        expires_in = data.get("expires_in", 3600)
-
-        token_data = {
-            "access_token": access_token,
-            "refresh_token": refresh_token_val,
-            "expires_at": time.time() + expires_in - 30
-        }
+    tokens, res = exchange_code(code)
 
-        with open(TOKEN_FILE, "w") as f:
-            json.dump(token_data, f)
-
-        return access_token
+    if tokens:
+        get_token_manager().set_tokens(tokens)
+        return tokens["access_token"]
     else:
         print("[red]Failed to authenticate with Spotify.[/red]")
         print(f"[yellow]Status: {res.status_code}[/yellow]")
@@ -117,56 +125,92 @@ def authorize_user():
         exit()
 
 def get_current_user_id(access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get("https://api.spotify.com/v1/me", headers=headers)
+    response = http_client.get(f"{SPOTIFY_API_BASE}/v1/me", headers=auth_header(access_token))
     if response.status_code == 200:
         return response.json()["id"]
     else:
         print("[red]❌ Could not get Spotify user ID[/red]")
         return None
 
-def get_user_playlists(access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    playlists = []
-    url = "https://api.spotify.com/v1/me/playlists"
-    
-    while url:
-        res = requests.get(url, headers=headers)
-        data = res.json()
-        playlists.extend(data.get("items", []))
-        url = data.get("next")  # paginated results
-
-    return playlists
+def paginate(access_token, url, params=None, page_size=100, fields=None, concurrency=PAGE_CONCURRENCY):
+    """Fetches every item of a Spotify paging object.
 
-def get_playlist_tracks(access_token, playlist_id):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    tracks = []
+    The first page tells us `total`, so the remaining offsets are requested
+    concurrently and stitched back together in order. Returns (items, None),
+    or (None, response) for the first page that failed.
+    """
+    params = dict(params or {})
+    if fields:
+        params["fields"] = fields if "total" in fields else f"{fields},total"
 
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    while url:
-        res = requests.get(url, headers=headers)
-        
+    def fetch(offset):
+        res = http_client.get(url, headers=auth_header(access_token),
+                              params={**params, "offset": offset, "limit": page_size})
         if res.status_code != 200:
-            breakpoint()
-            print(f"[red]❌ Failed to fetch playlist tracks: {res.status_code} - {res.text}[/red]")
-            sys.exit()
-            return []
-
+            return None, res
         try:
-            data = res.json()
+            return res.json(), None
         except ValueError:
-            print(f"[red]❌ Invalid JSON in playlist tracks response[/red]")
-            return []
+            return None, res
 
-        items = data.get("items", [])
-        for item in items:
-            track = item.get("track")
-            if track:
-                tracks.append(track)
+    first, error = fetch(0)
+    if error is not None:
+        return None, error
+
+    offsets = range(page_size, first.get("total", 0), page_size)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        pages = list(pool.map(fetch, offsets))
+
+    items = list(first.get("items", []))
+    for page, error in pages:
+        if error is not None:
+            return None, error
+        items.extend(page.get("items", []))
+
+    return items, None
+
+
+def get_user_playlists(access_token):
+    playlists, error = paginate(access_token, f"{SPOTIFY_API_BASE}/v1/me/playlists", page_size=50)
+    if error is not None:
+        print(f"[red]❌ Failed to fetch playlists: {error.status_code} - {error.text}[/red]")
+        return []
+    return playlists
+
+def get_playlist_tracks(access_token, playlist_id, fields=None):
+    url = f"{SPOTIFY_API_BASE}/v1/playlists/{playlist_id}/tracks"
+    items, error = paginate(access_token, url, fields=fields)
+
+    if error is not None:
+        raise SpotifyError(f"Failed to fetch playlist tracks: {error.status_code} - {error.text}")
+
+    return [item["track"] for item in items if item.get("track")]
+
+def get_playlist_snapshot(access_token, playlist_id):
+    res = http_client.get(f"{SPOTIFY_API_BASE}/v1/playlists/{playlist_id}", headers=auth_header(access_token),
+                          params={"fields": "snapshot_id"})
+    if res.status_code != 200:
+        return None
+    return res.json().get("snapshot_id")
 
-        url = data.get("next")  # handle pagination
 
-    return tracks
+@timed("dedupe")
+def get_playlist_uris(access_token, playlist_id, playlist_index=None):
+    """Returns the set of track URIs in a playlist, served from the index while the snapshot is unchanged."""
+    if playlist_index is None:
+        return {track["uri"] for track in get_playlist_tracks(access_token, playlist_id, PLAYLIST_TRACK_FIELDS)}
+
+    snapshot_id = get_playlist_snapshot(access_token, playlist_id)
+    if snapshot_id:
+        uris = playlist_index.get(playlist_id, snapshot_id)
+        if uris is not None:
+            return uris
+
+    uris = {track["uri"] for track in get_playlist_tracks(access_token, playlist_id, PLAYLIST_TRACK_FIELDS)}
+    if snapshot_id:
+        playlist_index.replace(playlist_id, snapshot_id, uris)
+    return uris
+
 
 def extract_playlist_id(url_or_id):
     if "spotify.com/playlist/" in url_or_id:
@@ -175,12 +219,12 @@ def extract_playlist_id(url_or_id):
     return url_or_id  # assume it's a raw ID
 
 
-from difflib import SequenceMatcher
+from matching import best_match, normalize
 
 def create_spotify_playlist(access_token, user_id, name, description="", public=False):
-    url = f"https://api.spotify.com/v1/users/{user_id}/playlists"
+    url = f"{SPOTIFY_API_BASE}/v1/users/{user_id}/playlists"
     headers = {
-        "Authorization": f"Bearer {access_token}",
+        **auth_header(access_token),
         "Content-Type": "application/json"
     }
     data = {
@@ -188,7 +232,7 @@ def create_spotify_playlist(access_token, user_id, name, description="", public=
         "description": description,
         "public": public
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = http_client.post(url, headers=headers, json=data)
     if response.status_code == 201:
         playlist = response.json()
         print(f"✅ Created playlist: [bold]{playlist['name']}[/bold]")
@@ -198,80 +242,550 @@ def create_spotify_playlist(access_token, user_id, name, description="", public=
         return None
 
 
-def add_songs_to_playlist(access_token, songs, artist_name, playlist_id, progress_callback=None):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    uris = []
+search_tier_stats = Counter()
+_search_tier_lock = threading.Lock()
 
-    # Get the existing tracks in the playlist
-    existing_tracks = get_playlist_tracks(access_token, playlist_id)
-    existing_uris = {track["uri"] for track in existing_tracks}
 
-    total_songs = len(songs)
+def record_search_tier(tier):
+    with _search_tier_lock:
+        search_tier_stats[tier] += 1
+
 
-    def similar(a, b): return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-
-    for i, song in enumerate(songs):
-        if progress_callback:
-            progress_callback(i, total_songs, f"Searching for: {song}...")
-
-        search = requests.get("https://api.spotify.com/v1/search", headers=headers, params={
-            "q": f"{artist_name} {song} ",
-            "type": "track",
-            "limit": 10
-        }).json()
-
-        tracks = search.get("tracks", {}).get("items", [])
-        found = False
-
-        for track in tracks:
-            track_artists = [artist["name"] for artist in track["artists"]]
-            track_uri = track["uri"]
-
-            if any(similar(track_artist, artist_name) > 0.8 for track_artist in track_artists):
-                if track_uri not in existing_uris:  # Check if the track is already in the playlist
-                    uris.append(track_uri)
-                    existing_uris.add(track_uri)  # Add the URI to the set of existing URIs
-                    print(f"✅ Found and added: {song} by {', '.join(track_artists)} {track_uri}")
-                else:
-                    print(f"❌ Skipping duplicate: {song} by {', '.join(track_artists)} {track_uri}")
-                found = True
+def search_queries(song, artist_name):
+    """Search tiers from strictest to loosest, as (tier name, query, limit)."""
+    song_q = song.replace('"', "")
+    artist_q = artist_name.replace('"', "")
+    core = normalize(song) or song_q
+    tiers = [
+        ("exact", f'track:"{song_q}" artist:"{artist_q}"', 5),
+        ("core", f'track:"{core}" artist:"{artist_q}"', 5),
+        ("artist", f'{core} artist:"{artist_q}"', 10),
+        ("free", f"{artist_name} {song} ", 10),
+    ]
+    # "core" is only worth a request when normalizing changed the title
+    return [tier for tier in tiers if not (tier[0] == "core" and core == song_q.lower())]
+
+
+def search_track(access_token, song, artist_name):
+    """Searches Spotify for a song, loosening the query on each miss.
+
+    Returns (uri, artists label, match score, candidate names, ok); ok is
+    False when a request failed, so the miss must not be cached.
+    """
+    candidates = []
+    for tier, query, limit in search_queries(song, artist_name):
+        try:
+            res = http_client.get(f"{SPOTIFY_API_BASE}/v1/search", headers=auth_header(access_token), params={
+                "q": query,
+                "type": "track",
+                "limit": limit
+            })
+            # Error pages (e.g. a 502 from a proxy) are not always JSON
+            search = res.json() if res.status_code == 200 else {}
+        except (requests.RequestException, ValueError) as e:
+            print(f"⚠️ Search failed for {song}: {e}")
+            return None, None, None, candidates, False
+        if "tracks" not in search:
+            print(f"⚠️ Search failed for {song}: {res.status_code}")
+            return None, None, None, candidates, False
+
+        tracks = search["tracks"].get("items", [])
+        candidates.extend(t["name"] for t in tracks)
+        track, score = best_match(tracks, song, artist_name)
+        if track:
+            record_search_tier(tier)
+            return track["uri"], ", ".join(artist["name"] for artist in track["artists"]), score, candidates, True
+
+    record_search_tier("miss")
+    return None, None, None, candidates, True
+
+
+def song_name(song):
+    """Setlist entries are song records from setlists.parse_setlist or, from older callers, plain titles."""
+    return song if isinstance(song, str) else song["name"]
+
+
+def search_artist(song, artist_name):
+    """The artist a setlist entry is searched under: the original artist for covers, and
+    None for tape entries that are not searched at all."""
+    if isinstance(song, str):
+        return artist_name
+    if song.get("tape"):
+        return song.get("cover") if INCLUDE_TAPES else None
+    return song.get("cover") or artist_name
+
+
+def song_pairs(songs, artist_name):
+    """(search artist, title) pairs for a setlist's entries, in setlist order."""
+    return [(search_artist(song, artist_name), song_name(song)) for song in songs]
+
+
+@timed("resolve")
+def resolve_song(access_token, song, artist_name, track_cache=None, catalog=None):
+    """Resolves one song to (uri, artists label, ok); ok is False when the search failed,
+    so a missing uri is not a confirmed miss.
+
+    The track cache is checked first, then the artist catalog when given;
+    only what neither knows goes to /v1/search.
+    """
+    if track_cache is not None:
+        hit, track_uri, label = track_cache.get(artist_name, song)
+        if hit:
+            return track_uri, label, True
+
+    if catalog is not None:
+        track, score = catalog.match(song)
+        if track:
+            label = ", ".join(artist["name"] for artist in track["artists"])
+            if track_cache is not None:
+                track_cache.put(artist_name, song, track["uri"], label, score)
+            return track["uri"], label, True
+
+    track_uri, label, score, candidates, ok = search_track(access_token, song, artist_name)
+    if track_cache is not None and ok:
+        track_cache.put(artist_name, song, track_uri, label, score)
+    if not track_uri:
+        print(candidates)
+        print(f"{song} {artist_name}")
+    return track_uri, label, ok
+
+
+def iter_resolved(access_token, pairs, track_cache=None, progress_callback=None, concurrency=SEARCH_CONCURRENCY,
+                  catalogs=None):
+    """Resolves (artist, song) pairs concurrently, each distinct pair once.
+
+    Yields (pair, (uri, artists label, ok)) in the order of `pairs`, each as
+    soon as it and everything before it is resolved. `catalogs` optionally
+    maps artist names to prefetched ArtistCatalogs. Pairs without an artist
+    (see search_artist) resolve to (None, None, True) without a search.
+    """
+    catalogs = catalogs or {}
+    unique_pairs = [pair for pair in dict.fromkeys(pairs) if pair[0]]
+    results = {pair: (None, None, True) for pair in pairs if not pair[0]}
+    total = len(unique_pairs)
+    next_index = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(resolve_song, access_token, song, artist_name, track_cache,
+                        catalogs.get(artist_name)): (artist_name, song)
+            for artist_name, song in unique_pairs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            pair = futures[future]
+            results[pair] = future.result()
+            if progress_callback:
+                progress_callback(done, total, f"Searched: {pair[1]}")
+
+            while next_index < len(pairs) and pairs[next_index] in results:
+                yield pairs[next_index], results[pairs[next_index]]
+                next_index += 1
+
+    # Only skipped pairs are left when nothing needed a search
+    for pair in pairs[next_index:]:
+        yield pair, results[pair]
+
+
+def resolve_pairs(access_token, pairs, track_cache=None, progress_callback=None, concurrency=SEARCH_CONCURRENCY,
+                  catalogs=None):
+    """Returns a dict mapping every (artist, song) pair to its (uri, artists label, ok)."""
+    return dict(iter_resolved(access_token, pairs, track_cache, progress_callback, concurrency, catalogs))
+
+
+def resolve_songs(access_token, songs, artist_name, track_cache=None, progress_callback=None,
+                  concurrency=SEARCH_CONCURRENCY, catalog=None):
+    """Resolves songs concurrently; results are returned in setlist order."""
+    pairs = song_pairs(songs, artist_name)
+    catalogs = {artist_name: catalog} if catalog else None
+    return [result for _, result in iter_resolved(access_token, pairs, track_cache, progress_callback, concurrency, catalogs)]
+
+
+class PlaylistWriter:
+    """Appends URIs to a playlist from a background thread while searches continue.
+
+    URIs are written in the order they are added: a chunk is sent as soon as
+    it holds 100 URIs (the Spotify limit), or after `idle_flush` seconds
+    without new URIs. Every chunk's response is checked. After a 5xx or a
+    connection error a chunk is retried up to `retries` times, without the
+    URIs the playlist turns out to hold already. `on_write` is called with
+    the URIs of each chunk Spotify accepted.
+    """
+
+    _DONE = object()
+
+    def __init__(self, access_token, playlist_id, playlist_index=None, idle_flush=WRITE_IDLE_FLUSH,
+                 retries=WRITE_RETRIES, on_write=None):
+        self.access_token = access_token
+        self.playlist_id = playlist_id
+        self.playlist_index = playlist_index
+        self.on_write = on_write
+        self.idle_flush = idle_flush
+        self.retries = retries
+        self.added = 0
+        self.failed = []
+        self._broken = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, uri):
+        self._queue.put(uri)
+
+    def close(self):
+        """Flushes what is left, waits for the writer and returns the number of URIs added."""
+        if self._thread.is_alive():
+            self._queue.put(self._DONE)
+            self._thread.join()
+        return self.added
+
+    def _run(self):
+        pending = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_flush)
+            except queue.Empty:
+                if pending:
+                    self._flush(pending)
+                    pending = []
+                continue
+
+            if item is self._DONE:
+                if pending:
+                    self._flush(pending)
+                return
+
+            pending.append(item)
+            if len(pending) == 100:
+                self._flush(pending)
+                pending = []
+
+    def _flush(self, chunk):
+        # After an unexpected error the thread keeps draining the queue, so nothing is dropped
+        # silently: the failing chunk and every URI after it end up in `failed`
+        if self._broken:
+            self.failed.extend(chunk)
+            return
+        try:
+            self._write(chunk)
+        except Exception as e:
+            print(f"[red]Playlist writer stopped: {e!r}[/red]")
+            self._broken = True
+            self.failed.extend(chunk)
+
+    @timed("write")
+    def _write(self, chunk):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(WRITE_RETRY_DELAY * attempt)
+                # A POST that failed with a 5xx or timed out may still have been applied, so only
+                # the URIs that did not land are sent again
+                landed = self._landed(chunk)
+                if landed is None:
+                    break
+                self._accepted(landed)
+                landed = set(landed)
+                chunk = [uri for uri in chunk if uri not in landed]
+                if not chunk:
+                    return
+
+            try:
+                res = http_client.post(
+                    f"{SPOTIFY_API_BASE}/v1/playlists/{self.playlist_id}/tracks",
+                    headers=auth_header(self.access_token),
+                    json={"uris": chunk}
+                )
+            except requests.RequestException as e:
+                error = str(e)
+                continue
+
+            if res.status_code == 201:
+                if self.playlist_index is not None:
+                    self.playlist_index.add(self.playlist_id, res.json().get("snapshot_id"), chunk)
+                self._accepted(chunk)
+                return
+            error = f"{res.status_code} {res.text}"
+            # Client errors (bad URI, no permission) will not succeed on a retry
+            if res.status_code < 500:
                 break
-        
-        if not found:
-            print([t["name"] for t in tracks])
-            print(f"{song} {artist_name}")
-            #breakpoint()
+
+        print(f"[red]Failed to add {len(chunk)} songs: {error}[/red]")
+        self.failed.extend(chunk)
+
+    def _accepted(self, uris):
+        if not uris:
+            return
+        # Counted only once recorded, so a failing on_write leaves the URIs to another run
+        if self.on_write:
+            self.on_write(uris)
+        self.added += len(uris)
+
+    def _landed(self, chunk):
+        """The URIs of `chunk` that are in the playlist now, or None when it cannot be read."""
+        try:
+            # Re-reading through the index also brings it up to date with the new snapshot
+            present = get_playlist_uris(self.access_token, self.playlist_id, self.playlist_index)
+        except (SpotifyError, requests.RequestException) as e:
+            print(f"[red]Could not check which songs were added: {e}[/red]")
+            return None
+        return [uri for uri in chunk if uri in present]
+
+
+def add_uris_to_playlist(access_token, playlist_id, uris, playlist_index=None, on_write=None):
+    writer = PlaylistWriter(access_token, playlist_id, playlist_index, on_write=on_write)
+    for uri in uris:
+        writer.add(uri)
+    return finish_writes(writer)
+
+
+def finish_writes(writer):
+    added = writer.close()
+    if not writer.failed:
+        print("[green]🎉 Songs added to playlist![/green]")
+    elif added:
+        print(f"[yellow]⚠️ Added {added} songs, {len(writer.failed)} could not be added.[/yellow]")
+    else:
+        print(f"[red]❌ None of the {len(writer.failed)} songs could be added.[/red]")
+    return added
+
+
+def select_new_uris(songs, resolved, existing_uris):
+    """Walks resolved songs in order, printing each outcome and returning the URIs not yet in the playlist.
+
+    `existing_uris` is updated in place so later setlists in a batch see earlier additions.
+    """
+    uris = []
+    for song, (track_uri, label, ok) in zip(songs, resolved):
+        # Tape entries resolve to no artist whatever the headliner is
+        if search_artist(song, "") is None:
+            print(f"⏭️ Skipping tape: {song_name(song)}")
+            continue
+        song = song_name(song)
+        if not ok:
+            print(f"⚠️ Could not look up: {song}")
+            continue
+        if not track_uri:
             print(f"❌ Not found or wrong artist: {song}")
+            continue
+
+        if track_uri not in existing_uris:  # Check if the track is already in the playlist
+            uris.append(track_uri)
+            existing_uris.add(track_uri)  # Add the URI to the set of existing URIs
+            print(f"✅ Found and added: {song} by {label} {track_uri}")
+        else:
+            print(f"❌ Skipping duplicate: {song} by {label} {track_uri}")
+    return uris
+
 
-    if uris:
-        if progress_callback:
+def add_songs_to_playlist(access_token, songs, artist_name, playlist_id, progress_callback=None, track_cache=None,
+                          concurrency=SEARCH_CONCURRENCY, playlist_index=None, catalog=None, on_write=None):
+    """Searches the setlist's songs and adds the ones not in the playlist yet.
+
+    Returns (added, failed): the number of songs added, and the number that
+    could not be looked up or written and would need another run.
+    """
+
+    # Get the existing tracks in the playlist
+    existing_uris = get_playlist_uris(access_token, playlist_id, playlist_index)
+
+    total_songs = len(songs)
+    pairs = song_pairs(songs, artist_name)
+    catalogs = {artist_name: catalog} if catalog else None
+
+    # New URIs stream into the writer in setlist order while later songs are still being searched
+    writer = PlaylistWriter(access_token, playlist_id, playlist_index, on_write=on_write)
+    found_new = lookups_failed = 0
+    try:
+        results = iter_resolved(access_token, pairs, track_cache, progress_callback, concurrency, catalogs)
+        for song, (_, resolved) in zip(songs, results):
+            lookups_failed += failed_lookups([resolved])
+            for uri in select_new_uris([song], [resolved], existing_uris):
+                writer.add(uri)
+                found_new += 1
+        if found_new and progress_callback:
             progress_callback(total_songs, total_songs, "Adding songs to playlist...")
-        # Add in chunks of 100 (Spotify API limit)
-        for i in range(0, len(uris), 100):
-            chunk = uris[i:i+100]
-            res = requests.post(
-                f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks",
-                headers=headers,
-                json={"uris": chunk}
-            )
+    finally:
+        # Also when a lookup raises, so the writer thread does not outlive the sync
+        writer.close()
+
+    if not found_new:
+        print("No new songs found to add.")
+        return 0, lookups_failed
+    return finish_writes(writer), lookups_failed + len(writer.failed)
+
 
+def add_resolved_to_playlist(access_token, songs, resolved, playlist_id, playlist_index=None):
+    """Adds songs resolved earlier (one (uri, label, ok) per song, see resolve_songs) that are not in the playlist yet."""
+    existing_uris = get_playlist_uris(access_token, playlist_id, playlist_index)
+    uris = select_new_uris(songs, resolved, existing_uris)
     if not uris:
         print("No new songs found to add.")
         return 0
+    return add_uris_to_playlist(access_token, playlist_id, uris, playlist_index)
 
-    # Add non-duplicate songs to the playlist
-    #res = requests.post(
-    #    f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks",
-    #    headers=headers,
-    #    json={"uris": uris}
-    #)
 
-    if res.status_code == 201:
-        print("[green]🎉 Songs added to playlist![/green]")
-        return len(uris)
+def failed_lookups(resolved):
+    """The number of (uri, label, ok) results whose search failed."""
+    return sum(1 for _, _, ok in resolved if not ok)
+
+
+def sync_resolved_to_playlist(access_token, songs, resolved, playlist_id, playlist_index=None):
+    """Makes the playlist hold exactly the resolved songs, in setlist order; see sync_playlist."""
+    uris = select_new_uris(songs, resolved, set())
+    return sync_playlist(access_token, playlist_id, uris, playlist_index, failed_lookups(resolved))
+
+
+def read_playlist_state(access_token, playlist_id, attempts=3):
+    """Returns (snapshot_id, track URIs in playlist order), re-reading if the playlist changed while paging."""
+    for _ in range(attempts):
+        snapshot_id = get_playlist_snapshot(access_token, playlist_id)
+        uris = [track["uri"] for track in get_playlist_tracks(access_token, playlist_id, PLAYLIST_TRACK_FIELDS)]
+        if get_playlist_snapshot(access_token, playlist_id) == snapshot_id:
+            break
+    return snapshot_id, uris
+
+
+def longest_ordered_run(values):
+    """Indexes of a longest strictly increasing subsequence of `values`."""
+    tails, tail_index, previous = [], [], [None] * len(values)
+    for i, value in enumerate(values):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        previous[i] = tail_index[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(value)
+            tail_index.append(i)
+        else:
+            tails[lo] = value
+            tail_index[lo] = i
+
+    run = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        run.add(i)
+        i = previous[i]
+    return run
+
+
+def reorder_moves(current, target):
+    """Returns (range_start, insert_before) single-track moves that put the tracks of
+    `target` into target order within `current`. The longest run of tracks already in
+    order stays put; every other track is moved right after its predecessor in `target`.
+    Tracks of `current` that are not in `target` keep their place."""
+    position = {uri: i for i, uri in enumerate(current)}
+    keep = longest_ordered_run([position[uri] for uri in target])
+    items = list(current)
+    moves = []
+    for i, uri in enumerate(target):
+        if i in keep:
+            continue
+        start = items.index(uri)
+        insert_before = items.index(target[i - 1]) + 1 if i else 0
+        if insert_before in (start, start + 1):
+            continue
+        moves.append((start, insert_before))
+        items.pop(start)
+        items.insert(insert_before - 1 if insert_before > start else insert_before, uri)
+    return moves
+
+
+def _change_playlist(method, access_token, playlist_id, body):
+    """Sends one write to the playlist's items; returns the new snapshot_id, or None after printing the error."""
+    res = http_client.request(method, f"{SPOTIFY_API_BASE}/v1/playlists/{playlist_id}/tracks",
+                              headers=auth_header(access_token), json=body)
+    if res.status_code in (200, 201):
+        return res.json().get("snapshot_id")
+    print(f"[red]❌ Playlist update failed: {res.status_code} {res.text}[/red]")
+    return None
+
+
+def _chunks(items, size=100):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+@timed("sync")
+def sync_playlist(access_token, playlist_id, uris, playlist_index=None, failed=0):
+    """Makes the playlist hold exactly `uris`, in order, with as few write calls as possible.
+
+    Tracks that are not wanted are removed and missing ones appended, 100 per
+    call, then the rest are reordered with single-track moves. Removals and
+    moves pass the snapshot_id they were computed against, so Spotify applies
+    them to the playlist as we read it. When the diff would take more calls
+    than replacing the playlist outright, it is rebuilt instead.
+
+    `failed` is the number of songs whose lookup failed. Their tracks are
+    missing from `uris` but may well be in the playlist, where the diff would
+    remove them, so the playlist is left untouched unless it is 0.
+
+    Returns a dict with the number of tracks added, removed and moved, whether
+    the playlist was rebuilt, whether every write succeeded and `failed`.
+    """
+    if failed:
+        return {"added": 0, "removed": 0, "moved": 0, "rebuilt": False, "ok": False, "failed": failed}
+
+    target = list(dict.fromkeys(uris))
+    snapshot_id, current = read_playlist_state(access_token, playlist_id)
+    wanted = set(target)
+    counts = Counter(current)
+
+    # Local files cannot be added or removed through the Web API, so they stay where they are.
+    # A wanted track that is in the playlist twice is removed (which drops every copy) and added back.
+    local = {uri for uri in counts if uri.startswith("spotify:local:")}
+    removals = [uri for uri in counts if uri not in local and (uri not in wanted or counts[uri] > 1)]
+    removed = set(removals)
+    remaining = [uri for uri in current if uri not in removed]
+    present = set(remaining)
+    additions = [uri for uri in target if uri not in present]
+
+    after_add = remaining + additions
+    position = {uri: i for i, uri in enumerate(after_add)}
+    out_of_order = len(target) - len(longest_ordered_run([position[uri] for uri in target]))
+    diff_calls = len(_chunks(removals)) + len(_chunks(additions)) + out_of_order
+    rebuild_calls = max(1, len(_chunks(target)))
+    result = {"added": len(wanted - set(counts)), "removed": len(removed - wanted), "moved": 0,
+              "rebuilt": False, "ok": True, "failed": 0}
+
+    if diff_calls > rebuild_calls and not local:
+        result["rebuilt"] = True
+        chunks = _chunks(target) or [[]]
+        snapshot_id = _change_playlist("PUT", access_token, playlist_id, {"uris": chunks[0]})
+        for chunk in chunks[1:]:
+            if snapshot_id is None:
+                break
+            snapshot_id = _change_playlist("POST", access_token, playlist_id, {"uris": chunk})
     else:
-        print(f"[red]Failed to add songs: {res.text}[/red]")
-        return 0
+        for chunk in _chunks(removals):
+            if snapshot_id is None:
+                break
+            snapshot_id = _change_playlist("DELETE", access_token, playlist_id, {
+                "tracks": [{"uri": uri} for uri in chunk],
+                "snapshot_id": snapshot_id
+            })
+        for chunk in _chunks(additions):
+            if snapshot_id is None:
+                break
+            snapshot_id = _change_playlist("POST", access_token, playlist_id, {"uris": chunk})
+        for range_start, insert_before in reorder_moves(after_add, target):
+            if snapshot_id is None:
+                break
+            snapshot_id = _change_playlist("PUT", access_token, playlist_id, {
+                "range_start": range_start,
+                "insert_before": insert_before,
+                "range_length": 1,
+                "snapshot_id": snapshot_id
+            })
+            if snapshot_id is not None:
+                result["moved"] += 1
+
+    if snapshot_id is None:
+        result["ok"] = False
+    elif playlist_index is not None:
+        playlist_index.replace(playlist_id, snapshot_id, set(after_add))
+    return result
 
 
 ## for web app
@@ -283,4 +797,4 @@ def get_auth_url():
         "scope": "playlist-modify-public playlist-modify-private playlist-read-private"
     }
     print(f"\n DEBUG: Sending Redirect URI: {REDIRECT_URI}")
-    return f"https://accounts.spotify.com/authorize?{urlencode(params)}"
\ No newline at end of file
+    return f"{SPOTIFY_ACCOUNTS_BASE}/authorize?{urlencode(params)}"
\ No newline at end of file
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from fake_server import FakeState, make_server  # noqa: E402
+
+# The app modules read their settings on import, so the fake API is started first
+_state = FakeState()
+_, _base = make_server(_state)
+os.environ["SPOTIFY_API_BASE"] = _base
+os.environ["SPOTIFY_ACCOUNTS_BASE"] = _base
+os.environ["SETLIST_FM_API_BASE"] = f"{_base}/rest/1.0"
+os.environ["SETLIST_CACHE_DB"] = os.path.join(tempfile.mkdtemp(prefix="setlist-tests-"), "cache.db")
+os.environ["SPOTIFY_RATE_LIMIT"] = "1000"
+os.environ["SETLIST_FM_RATE_LIMIT"] = "1000"
+
+
+@pytest.fixture
+def fake_api():
+    """The fake Spotify and setlist.fm state, with no playlists left over from other tests."""
+    with _state.lock:
+        _state.playlists.clear()
+    _state.reset_stats()
+    return _state
@@ -0,0 +1,20 @@
+import time
+
+import app as web
+
+
+def test_login_keeps_spotify_tokens_out_of_the_session_cookie(monkeypatch):
+    tokens = {"access_token": "access", "refresh_token": "refresh-secret", "expires_at": time.time() + 3600}
+    monkeypatch.setattr(web, "exchange_code", lambda code: (tokens, None))
+    client = web.app.test_client()
+
+    client.get("/callback?code=abc")
+
+    with client.session_transaction() as session:
+        assert list(session) == ["sid"]
+        sid = session["sid"]
+    assert "refresh-secret" not in client.get_cookie("session").value
+    assert web.logins.get(sid) == tokens
+    with web.app.test_request_context():
+        web.session["sid"] = sid
+        assert web.session_access_token() == "access"
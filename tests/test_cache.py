@@ -0,0 +1,27 @@
+import sqlite3
+
+from cache import TrackCache
+
+
+def stored_stats(path):
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT name, value FROM cache_stats").fetchall())
+
+
+def test_lookups_are_counted_without_writing_each_one(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = TrackCache(path)
+    cache.put("Artist", "Song", "spotify:track:1", "Artist - Song")
+
+    assert cache.get("artist", "song")[0]
+    assert not cache.get("Artist", "Other")[0]
+
+    assert stored_stats(path) == {}
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+    cache.flush()
+    cache.get("Artist", "Song")
+
+    assert stored_stats(path) == {"hits": 1, "misses": 1}
+    assert TrackCache(path).stats() == {"hits": 1, "misses": 1}
+    assert cache.stats() == {"hits": 2, "misses": 1}
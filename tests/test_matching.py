@@ -0,0 +1,35 @@
+import pytest
+
+from matching import best_match, normalize, similarity
+
+
+def track(name, artist="Band"):
+    return {"uri": f"spotify:track:{name}", "name": name, "artists": [{"name": artist}]}
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Paranoid Android - Remastered 2011", "Paranoid Android"),
+    ("Hyperballad (feat. Someone)", "hyperballad"),
+    ("The Beatles", "Beatles"),
+    ("Sigur Rós", "Sigur Ros"),
+    ("(Intro)", "(intro)"),
+])
+def test_similarity_equal_after_normalizing(a, b):
+    assert similarity(a, b) == 1.0
+
+
+def test_bracket_only_titles_are_not_all_equal():
+    assert normalize("(Intro)") == normalize("(Interlude)") == ""
+    assert similarity("(Intro)", "(Interlude)") < 1.0
+    assert similarity("(Intro)", "") == 0.0
+
+
+def test_best_match_rejects_a_different_bracket_only_title():
+    assert best_match([track("(Interlude)")], "(Intro)", "Band") == (None, 0.0)
+    assert best_match([track("(Intro)")], "(Intro)", "Band")[0]["name"] == "(Intro)"
+
+
+def test_best_match_prefers_studio_version():
+    live, studio = track("Song - Live"), track("Song")
+    assert best_match([live, studio], "Song", "Band")[0] is studio
+    assert best_match([live, track("Song", artist="Someone Else")], "Song", "Band")[0] is live
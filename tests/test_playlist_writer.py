@@ -0,0 +1,37 @@
+from spotify_helper import PlaylistWriter
+
+PLAYLIST_ID = "writerplaylist"
+
+
+def write_all(uris, **kwargs):
+    writer = PlaylistWriter("token", PLAYLIST_ID, idle_flush=0.05, **kwargs)
+    for uri in uris:
+        writer.add(uri)
+    writer.close()
+    return writer
+
+
+def test_writes_in_order_in_chunks_of_100(fake_api):
+    fake_api.make_playlist(PLAYLIST_ID, 0)
+    uris = [f"spotify:track:n{i}" for i in range(250)]
+    chunks = []
+
+    writer = write_all(uris, on_write=chunks.append)
+
+    assert writer.added == 250 and writer.failed == []
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert fake_api.playlists[PLAYLIST_ID]["uris"] == uris
+
+
+def test_unexpected_error_fails_the_rest_instead_of_dropping_it(fake_api):
+    fake_api.make_playlist(PLAYLIST_ID, 0)
+    uris = [f"spotify:track:n{i}" for i in range(150)]
+
+    def on_write(chunk):
+        raise RuntimeError("journal is locked")
+
+    writer = write_all(uris, on_write=on_write)
+
+    assert writer.added == 0
+    assert writer.failed == uris
+    assert not writer._thread.is_alive()
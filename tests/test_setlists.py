@@ -0,0 +1,37 @@
+import pytest
+
+from fake_server import ARTIST_NAME
+from setlists import parse_setlist, search_setlists, setlist_id_from_url
+
+
+@pytest.mark.parametrize("count, concurrency", [(100, 2), (170, 3), (45, 1), (20, 2), (0, 2)])
+def test_search_setlists_fetches_every_page(fake_api, monkeypatch, count, concurrency):
+    # 20 setlists per page, so most cases need more than concurrency + 1 pages
+    monkeypatch.setattr(fake_api, "setlist_count", count)
+
+    ids = [setlist["id"] for setlist in search_setlists(ARTIST_NAME, concurrency=concurrency)]
+
+    assert ids == fake_api.setlist_ids()
+
+
+def test_parse_setlist_keeps_covers_and_tapes():
+    songs, artist = parse_setlist({
+        "artist": {"name": "Band"},
+        "sets": {"set": [
+            {"song": [{"name": "Intro", "tape": True}, {"name": "Own Song"}]},
+            {"song": [{"name": "Other Song", "cover": {"name": "Other Band"}, "info": "acoustic"}, {"name": ""}]},
+        ]},
+    })
+
+    assert artist == "Band"
+    assert songs == [
+        {"name": "Intro", "cover": None, "tape": True, "info": None},
+        {"name": "Own Song", "cover": None, "tape": False, "info": None},
+        {"name": "Other Song", "cover": "Other Band", "tape": False, "info": "acoustic"},
+    ]
+
+
+def test_setlist_id_from_url():
+    url = "https://www.setlist.fm/setlist/air/2025/parque-do-ibirapuera-sao-paulo-brazil-3b51b4dc.html"
+    assert setlist_id_from_url(url) == "3b51b4dc"
+    assert setlist_id_from_url("https://example.com/nope") is None
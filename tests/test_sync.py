@@ -0,0 +1,176 @@
+import random
+
+import fake_server
+import pytest
+
+from spotify_helper import longest_ordered_run, reorder_moves, sync_playlist, sync_resolved_to_playlist
+
+PLAYLIST_ID = "testplaylist"
+
+
+def apply_move(items, range_start, insert_before):
+    """Applies one single-track reorder the way Spotify does."""
+    items = list(items)
+    uri = items.pop(range_start)
+    items.insert(insert_before - 1 if insert_before > range_start else insert_before, uri)
+    return items
+
+
+def make_playlist(state, uris):
+    state.make_playlist(PLAYLIST_ID, 0)
+    with state.lock:
+        state.playlists[PLAYLIST_ID]["uris"] = list(uris)
+
+
+def playlist(state):
+    with state.lock:
+        return list(state.playlists[PLAYLIST_ID]["uris"])
+
+
+def requests_by_method(state):
+    counts = {}
+    for endpoint, count in state.requests.items():
+        method = endpoint.split()[0]
+        counts[method] = counts.get(method, 0) + count
+    return counts
+
+
+def is_increasing_run(values, indexes):
+    run = [values[i] for i in sorted(indexes)]
+    return all(a < b for a, b in zip(run, run[1:]))
+
+
+@pytest.mark.parametrize("values, length", [
+    ([], 0),
+    ([5], 1),
+    ([3, 2, 1], 1),
+    ([1, 2, 3], 3),
+    ([2, 0, 3, 1, 4], 3),
+    ([0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15], 6),
+])
+def test_longest_ordered_run(values, length):
+    run = longest_ordered_run(values)
+    assert len(run) == length
+    assert is_increasing_run(values, run)
+
+
+def test_reorder_moves_sorts_target_tracks():
+    rng = random.Random(7)
+    for _ in range(300):
+        current = [f"t{i}" for i in range(rng.randint(0, 25))]
+        rng.shuffle(current)
+        target = rng.sample(current, rng.randint(0, len(current)))
+        others = [uri for uri in current if uri not in target]
+
+        items = current
+        for range_start, insert_before in reorder_moves(current, target):
+            items = apply_move(items, range_start, insert_before)
+
+        assert [uri for uri in items if uri in target] == target
+        # Tracks that are not part of the target keep their relative order
+        assert [uri for uri in items if uri not in target] == others
+
+
+def test_reorder_moves_leaves_ordered_playlist_alone():
+    assert reorder_moves(["a", "x", "b", "c"], ["a", "b", "c"]) == []
+
+
+def test_sync_playlist_adds_removes_and_reorders(fake_api):
+    # Large enough that one removal, one addition and one move beat rewriting 251 tracks
+    target = [f"spotify:track:t{i}" for i in range(251)]
+    current = target[:10] + target[11:120] + ["spotify:track:unwanted"] + target[120:250] + [target[10]]
+    make_playlist(fake_api, current)
+
+    result = sync_playlist("token", PLAYLIST_ID, target)
+
+    assert playlist(fake_api) == target
+    assert result == {"added": 1, "removed": 1, "moved": 1, "rebuilt": False, "ok": True, "failed": 0}
+
+
+def test_sync_playlist_small_changes_rebuild(fake_api):
+    make_playlist(fake_api, ["spotify:track:c", "spotify:track:x", "spotify:track:a", "spotify:track:b"])
+    target = ["spotify:track:a", "spotify:track:b", "spotify:track:c", "spotify:track:d"]
+
+    result = sync_playlist("token", PLAYLIST_ID, target)
+
+    assert playlist(fake_api) == target
+    assert result["rebuilt"] and result["ok"]
+
+
+def test_sync_playlist_removes_duplicates_and_keeps_local_files(fake_api):
+    local = "spotify:local:Artist:Album:Demo:180"
+    make_playlist(fake_api, ["spotify:track:a", local, "spotify:track:b", "spotify:track:a"])
+
+    result = sync_playlist("token", PLAYLIST_ID, ["spotify:track:a", "spotify:track:b"])
+
+    assert result["ok"] and not result["rebuilt"]
+    # The local file cannot be removed or re-added, so the playlist is never rebuilt around it
+    assert [uri for uri in playlist(fake_api) if uri != local] == ["spotify:track:a", "spotify:track:b"]
+    assert local in playlist(fake_api)
+
+
+def test_sync_playlist_rebuilds_when_cheaper(fake_api):
+    make_playlist(fake_api, [f"spotify:track:old{i}" for i in range(300)])
+    target = [f"spotify:track:new{i}" for i in range(150)]
+
+    result = sync_playlist("token", PLAYLIST_ID, target)
+
+    assert result["rebuilt"] and result["ok"]
+    assert playlist(fake_api) == target
+    assert requests_by_method(fake_api).get("DELETE", 0) == 0
+
+
+def test_sync_playlist_without_changes_writes_nothing(fake_api):
+    target = ["spotify:track:a", "spotify:track:b"]
+    make_playlist(fake_api, target)
+
+    result = sync_playlist("token", PLAYLIST_ID, target)
+
+    assert result == {"added": 0, "removed": 0, "moved": 0, "rebuilt": False, "ok": True, "failed": 0}
+    assert set(requests_by_method(fake_api)) == {"GET"}
+
+
+def test_sync_stops_when_a_lookup_failed(fake_api):
+    before = ["spotify:track:song1", "spotify:track:song2", "spotify:track:other"]
+    make_playlist(fake_api, before)
+    songs = ["Song 1", "Song 2"]
+    # Song 2 is in the playlist, but its search failed this time
+    resolved = [("spotify:track:song1", "Bench Band", True), (None, None, False)]
+
+    result = sync_resolved_to_playlist("token", songs, resolved, PLAYLIST_ID)
+
+    assert result["failed"] == 1 and not result["ok"]
+    assert playlist(fake_api) == before
+    assert fake_api.total_requests() == 0
+
+
+def test_sync_removes_confirmed_misses_only(fake_api):
+    make_playlist(fake_api, ["spotify:track:song1", "spotify:track:other"])
+    songs = ["Song 1", "Unreleased Jam"]
+    resolved = [("spotify:track:song1", "Bench Band", True), (None, None, True)]
+
+    result = sync_resolved_to_playlist("token", songs, resolved, PLAYLIST_ID)
+
+    assert result["ok"] and result["removed"] == 1
+    assert playlist(fake_api) == ["spotify:track:song1"]
+
+
+def test_sync_does_not_replay_a_move_after_a_server_error(fake_api, monkeypatch):
+    # Large enough that the one out-of-place track is moved rather than the playlist rebuilt
+    target = [f"spotify:track:t{i}" for i in range(250)]
+    make_playlist(fake_api, target[1:] + target[:1])
+    route = fake_server.FakeHandler.route
+
+    def applied_but_failed(self, method, path, query, body):
+        status, payload = route(self, method, path, query, body)
+        if method == "PUT" and "range_start" in body:
+            return 503, {"error": {"status": 503, "message": "Service unavailable"}}
+        return status, payload
+
+    monkeypatch.setattr(fake_server.FakeHandler, "route", applied_but_failed)
+
+    result = sync_playlist("token", PLAYLIST_ID, target)
+
+    assert not result["ok"]
+    assert playlist(fake_api) == target
+    assert fake_api.requests["PUT /v1/playlists/{id}/tracks"] == 1
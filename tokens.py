@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 300))
+
+
+def token_data(response_json, refresh_token=None):
+    """Builds the stored token record from a Spotify token endpoint response."""
+    expires_in = response_json.get("expires_in", 3600)
+    return {
+        "access_token": response_json["access_token"],
+        # A refresh response only includes a refresh token when Spotify rotates it
+        "refresh_token": response_json.get("refresh_token") or refresh_token,
+        "expires_at": time.time() + expires_in - 30
+    }
+
+
+class TokenManager:
+    """Keeps one user's Spotify tokens in memory and refreshes them before they expire.
+
+    Callers that need a token while a refresh is running wait for it and
+    get the new token, so only one refresh request is ever in flight. When
+    `path` is set the tokens are loaded from and atomically saved to it.
+    """
+
+    def __init__(self, refresh_fn, tokens=None, path=None, refresh_margin=REFRESH_MARGIN):
+        self.refresh_fn = refresh_fn
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self._tokens = tokens
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return dict(self._tokens) if self._tokens else None
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".spotify_token.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._tokens, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _fresh(self, tokens):
+        return tokens and time.time() < tokens["expires_at"] - self.refresh_margin
+
+    def set_tokens(self, tokens):
+        with self._lock:
+            self._tokens = tokens
+            self._save()
+
+    def get_access_token(self):
+        """Returns a usable access token, refreshing it if needed, or None if re-authentication is required."""
+        with self._lock:
+            if self._tokens is None:
+                self._tokens = self._load()
+            if self._tokens is None:
+                return None
+            if self._fresh(self._tokens):
+                return self._tokens["access_token"]
+
+            # Another process may already have refreshed the shared token file
+            on_disk = self._load()
+            if self._fresh(on_disk):
+                self._tokens = on_disk
+                return on_disk["access_token"]
+
+            refreshed = self.refresh_fn(self._tokens["refresh_token"])
+            if refreshed:
+                self._tokens = refreshed
+                self._save()
+                return refreshed["access_token"]
+
+            # Refresh failed; the old token may still have a few minutes left
+            if time.time() < self._tokens["expires_at"]:
+                return self._tokens["access_token"]
+            return None
+
+
+def auth_header(token):
+    """Authorization header for an access token or a TokenManager. A manager is asked on
+    every call, so long runs keep working after the token they started with expires."""
+    if isinstance(token, TokenManager):
+        token = token.get_access_token()
+    return {"Authorization": f"Bearer {token}"}
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+MAX_SHARED_MANAGERS = 1000
+
+
+def shared_token_manager(tokens, refresh_fn):
+    """Returns the process-wide manager for these tokens, so concurrent web jobs of
+    one user share a single in-memory copy and a single in-flight refresh."""
+    key = tokens["refresh_token"]
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            if len(_managers) >= MAX_SHARED_MANAGERS:
+                _managers.pop(next(iter(_managers)))
+            manager = _managers[key] = TokenManager(refresh_fn, tokens=tokens)
+        return manager